@@ -1,9 +1,11 @@
 import tensorflow as tf
 import numpy as np
-import json
 import h5py
+import zipfile
 from pathlib import Path
 
+from lesion_analyzer.model_metadata import read_model_metadata
+
 def diagnose_keras_model(model_path):
     """Diagnose a .keras model file to understand its structure"""
     print(f"Diagnosing model: {model_path}")
@@ -12,34 +14,23 @@ def diagnose_keras_model(model_path):
     try:
         # Try to load model metadata without full loading
         if model_path.endswith('.keras'):
-            # .keras files are ZIP archives, we can peek inside
-            import zipfile
-            with zipfile.ZipFile(model_path, 'r') as zip_file:
-                if 'config.json' in zip_file.namelist():
-                    config_data = zip_file.read('config.json')
-                    config = json.loads(config_data.decode('utf-8'))
-                    
-                    print("Model Configuration:")
-                    print(f"Name: {config.get('name', 'Unknown')}")
-                    print(f"Class: {config.get('class_name', 'Unknown')}")
-                    
-                    # Look for input layer info
-                    layers = config.get('config', {}).get('layers', [])
-                    for layer in layers:
-                        if layer.get('class_name') == 'InputLayer':
-                            batch_shape = layer.get('config', {}).get('batch_shape')
-                            if batch_shape:
-                                print(f"Expected input shape: {batch_shape}")
-                                return batch_shape[1:]  # Remove batch dimension
-                    
-                    # If no InputLayer found, look in first layer
-                    if layers:
-                        first_layer = layers[0]
-                        print(f"First layer: {first_layer.get('class_name')}")
-                        if 'input_shape' in first_layer.get('config', {}):
-                            input_shape = first_layer['config']['input_shape']
-                            print(f"Input shape from first layer: {input_shape}")
-                            return input_shape
+            # .keras files are ZIP archives; config.json describes the graph
+            try:
+                metadata = read_model_metadata(model_path)
+            except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+                print(f"Could not read model metadata: {e}")
+                metadata = None
+            if metadata:
+                print("Model Configuration:")
+                print(f"Name: {metadata['name'] or 'Unknown'}")
+                print(f"Class: {metadata['class_name'] or 'Unknown'}")
+                print(f"Layers: {metadata['layer_count']}")
+                print(f"Input dtype: {metadata['dtype']}")
+                print(f"Output shapes: {metadata['output_shapes']}")
+                if metadata['input_shapes'] and metadata['input_shapes'][0]:
+                    batch_shape = metadata['input_shapes'][0]
+                    print(f"Expected input shape: {batch_shape}")
+                    return batch_shape[1:]  # Remove batch dimension
         
         # Fallback: try to load and inspect
         print("Trying to load model for inspection...")
@@ -73,6 +64,13 @@ def test_different_input_shapes(model_path, base_shape=(256, 256, 3)):
         (384, 384, 3),  # EfficientNet variants
     ]
     
+    # Load once; only the dummy input changes between attempts
+    try:
+        model = tf.keras.models.load_model(model_path, compile=False, safe_mode=False)
+    except Exception as e:
+        print(f"Failed to load model: {e}")
+        return None
+    
     for shape in test_shapes:
         try:
             print(f"Testing shape: {shape}")
@@ -80,8 +78,7 @@ def test_different_input_shapes(model_path, base_shape=(256, 256, 3)):
             # Create dummy input
             dummy_input = tf.random.normal((1,) + shape)
             
-            # Try to load model and predict
-            model = tf.keras.models.load_model(model_path, compile=False, safe_mode=False)
+            # Try to predict
             output = model(dummy_input)
             
             print(f"✓ SUCCESS with shape {shape}")
@@ -5,5 +5,10 @@ from .models import LesionAnalysis
 class LesionAnalysisAdmin(admin.ModelAdmin):
     list_display = ['id', 'predicted_class', 'confidence_score', 'created_at']
     list_filter = ['predicted_class', 'created_at']
-    readonly_fields = ['created_at']
+    readonly_fields = [
+        'created_at', 'lesion_area', 'lesion_perimeter', 'asymmetry_score',
+        'border_irregularity', 'color_variance', 'diameter_px', 'feature_resolution',
+        'quality_sharpness', 'quality_brightness', 'quality_clipped_fraction',
+        'quality_skin_coverage', 'quality_issues', 'classification_ms', 'explanation_ms',
+    ]
     search_fields = ['predicted_class']
\ No newline at end of file
@@ -0,0 +1,162 @@
+from collections import deque
+from contextlib import contextmanager
+from django.conf import settings
+import threading
+import math
+import time
+
+import numpy as np
+
+
+class AdmissionRejected(Exception):
+    """Raised when an analysis is shed instead of admitted"""
+
+    def __init__(self, reason, status, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+class TokenBucketLimiter:
+    """Per-client token buckets refilled at `rate` tokens per second up to `burst`"""
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def allow(self, client):
+        """Take one token; returns (allowed, seconds until a token is available)"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self.buckets[client] = (tokens - 1, now)
+                allowed, wait = True, 0.0
+            else:
+                self.buckets[client] = (tokens, now)
+                allowed, wait = False, (1 - tokens) / self.rate
+            if len(self.buckets) > self.max_clients:
+                self.prune(now)
+        return allowed, wait
+
+    def prune(self, now):
+        # A bucket that has refilled completely carries no state worth keeping
+        full_after = self.burst / self.rate
+        self.buckets = {
+            client: state for client, state in self.buckets.items()
+            if now - state[1] < full_after
+        }
+
+
+class AdmissionController:
+    """Caps concurrent analyses and the queue in front of them, shedding the excess"""
+
+    def __init__(self, max_in_flight, max_queued, queue_timeout, retry_after,
+                 rate_limiter=None, wait_samples=1000):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.rate_limiter = rate_limiter
+
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {'rate_limited': 0, 'queue_full': 0, 'queue_timeout': 0}
+        self.queue_waits = deque(maxlen=wait_samples)
+
+    def acquire(self, client=None):
+        """Block until a slot is free; raises AdmissionRejected instead of queueing without bound"""
+        if self.rate_limiter is not None and client is not None:
+            allowed, wait = self.rate_limiter.allow(client)
+            if not allowed:
+                with self.condition:
+                    self.rejected['rate_limited'] += 1
+                raise AdmissionRejected('rate_limited', 429, max(1, math.ceil(wait)))
+
+        started = time.monotonic()
+        with self.condition:
+            if self.in_flight >= self.max_in_flight:
+                if self.queued >= self.max_queued:
+                    self.rejected['queue_full'] += 1
+                    raise AdmissionRejected('queue_full', 503, self.retry_after)
+                self.queued += 1
+                try:
+                    admitted = self.condition.wait_for(
+                        lambda: self.in_flight < self.max_in_flight, timeout=self.queue_timeout
+                    )
+                finally:
+                    self.queued -= 1
+                if not admitted:
+                    self.rejected['queue_timeout'] += 1
+                    raise AdmissionRejected('queue_timeout', 503, self.retry_after)
+            self.in_flight += 1
+            self.admitted += 1
+            self.queue_waits.append(time.monotonic() - started)
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    @contextmanager
+    def slot(self, client=None):
+        self.acquire(client)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def metrics(self):
+        with self.condition:
+            waits = np.array(self.queue_waits) if self.queue_waits else None
+            return {
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'max_in_flight': self.max_in_flight,
+                'max_queued': self.max_queued,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'queue_wait_seconds': {
+                    'p50': float(np.percentile(waits, 50)),
+                    'p95': float(np.percentile(waits, 95)),
+                    'p99': float(np.percentile(waits, 99)),
+                    'max': float(waits.max()),
+                } if waits is not None else None,
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                rate_limiter = None
+                rate = getattr(settings, 'LESION_CLIENT_RATE_LIMIT', None)
+                if rate:
+                    rate_limiter = TokenBucketLimiter(
+                        rate / 60.0, getattr(settings, 'LESION_CLIENT_BURST', 5)
+                    )
+                _controller = AdmissionController(
+                    max_in_flight=getattr(settings, 'LESION_MAX_IN_FLIGHT',
+                                          getattr(settings, 'LESION_INFERENCE_WORKERS', 2)),
+                    max_queued=getattr(settings, 'LESION_MAX_QUEUED', 8),
+                    queue_timeout=getattr(settings, 'LESION_QUEUE_TIMEOUT', 10),
+                    retry_after=getattr(settings, 'LESION_RETRY_AFTER', 5),
+                    rate_limiter=rate_limiter,
+                )
+    return _controller
+
+
+def client_key(request):
+    return request.META.get('REMOTE_ADDR', 'unknown')
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LesionAnalyzerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'lesion_analyzer'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,112 @@
+"""Shard writers for export_dataset, importable by worker processes without the ORM"""
+from PIL import Image
+import numpy as np
+import tarfile
+import json
+import time
+import io
+import os
+
+_classifier = None
+
+
+def init_worker():
+    global _classifier
+    from lesion_analyzer.ml_utils import LesionClassifier
+    _classifier = LesionClassifier(load_models=False)
+
+
+def _load_mask(mask_path, size):
+    with Image.open(mask_path) as mask_file:
+        mask = mask_file.convert('L')
+        if mask.size != size:
+            mask = mask.resize(size, Image.NEAREST)
+        return np.array(mask)
+
+
+def _npy_bytes(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def _add_tar_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _write_tar_shard(path, samples):
+    with tarfile.open(path, 'w') as tar:
+        for sample in samples:
+            key = f"{sample['id']:09d}"
+            _add_tar_member(tar, f'{key}.image.npy', _npy_bytes(sample['image']))
+            if sample['mask'] is not None:
+                _add_tar_member(tar, f'{key}.mask.npy', _npy_bytes(sample['mask']))
+            metadata = {
+                'id': sample['id'],
+                'label': sample['label'],
+                'confidence': sample['confidence'],
+            }
+            _add_tar_member(tar, f'{key}.json', json.dumps(metadata).encode('utf-8'))
+
+
+def _write_tfrecord_shard(path, samples):
+    import tensorflow as tf
+
+    def bytes_feature(value):
+        return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+    with tf.io.TFRecordWriter(path) as writer:
+        for sample in samples:
+            mask = sample['mask']
+            feature = {
+                'id': tf.train.Feature(int64_list=tf.train.Int64List(value=[sample['id']])),
+                'image': bytes_feature(sample['image'].tobytes()),
+                'image_shape': tf.train.Feature(int64_list=tf.train.Int64List(value=list(sample['image'].shape))),
+                'mask': bytes_feature(mask.tobytes() if mask is not None else b''),
+                'label': bytes_feature(sample['label'].encode('utf-8')),
+                'confidence': tf.train.Feature(float_list=tf.train.FloatList(value=[sample['confidence']])),
+            }
+            example = tf.train.Example(features=tf.train.Features(feature=feature))
+            writer.write(example.SerializeToString())
+
+
+def export_shard(shard_index, rows, output_dir, export_format):
+    """Preprocess one shard worth of rows and write it atomically"""
+    samples = []
+    errors = []
+    for row in rows:
+        try:
+            image = _classifier.load_preprocessed(row['image_path'])
+            mask = None
+            if row['mask_path']:
+                mask = _load_mask(row['mask_path'], (image.shape[1], image.shape[0]))
+            samples.append({
+                'id': row['id'],
+                'image': image.astype(np.uint8),
+                'mask': mask,
+                'label': row['label'],
+                'confidence': row['confidence'],
+            })
+        except Exception as e:
+            errors.append(f"Analysis {row['id']}: {e}")
+
+    extension = 'tfrecord' if export_format == 'tfrecord' else 'tar'
+    path = os.path.join(output_dir, f'shard-{shard_index:06d}.{extension}')
+    tmp_path = path + '.tmp'
+    if export_format == 'tfrecord':
+        _write_tfrecord_shard(tmp_path, samples)
+    else:
+        _write_tar_shard(tmp_path, samples)
+    os.replace(tmp_path, path)
+
+    return {
+        'shard_index': shard_index,
+        'path': path,
+        'bytes': os.path.getsize(path),
+        'samples': len(samples),
+        'last_id': rows[-1]['id'],
+        'errors': errors,
+    }
@@ -0,0 +1,161 @@
+"""Grad-CAM explanations computed in the same forward pass as classification"""
+from concurrent.futures import Future
+from django.conf import settings
+import numpy as np
+import tensorflow as tf
+import threading
+import queue
+import time
+import cv2
+
+_batcher_lock = threading.Lock()
+
+
+def find_last_conv_layer(model):
+    """Last top-level layer producing a spatial feature map (a nested backbone counts as one)"""
+    for layer in reversed(model.layers):
+        try:
+            shape = layer.output.shape
+        except (AttributeError, ValueError):
+            continue
+        if len(shape) == 4:
+            return layer
+    raise ValueError('Model has no layer with a 4D output to explain')
+
+
+def build_grad_model(model):
+    """Model returning (feature maps, predictions) from a single call"""
+    layer = find_last_conv_layer(model)
+    try:
+        return tf.keras.Model(model.inputs, [layer.output, model.outputs[0]])
+    except ValueError:
+        # Keras 3 ties a nested backbone's output to its own inputs, so replay
+        # the top-level layers as a chain to reach it from the outer input
+        inputs = tf.keras.Input(shape=model.input_shape[1:])
+        x = inputs
+        for current in model.layers:
+            if isinstance(current, tf.keras.layers.InputLayer):
+                continue
+            x = current(x)
+            if current is layer:
+                feature_maps = x
+        return tf.keras.Model(inputs, [feature_maps, x])
+
+
+def classify_and_explain(grad_model, images):
+    """Predictions and Grad-CAM maps for a batch, from one taped forward pass"""
+    images = tf.convert_to_tensor(images, dtype=tf.float32)
+    started = time.perf_counter()
+    with tf.GradientTape() as tape:
+        feature_maps, predictions = grad_model(images, training=False)
+        class_indices = tf.argmax(predictions, axis=-1)
+        scores = tf.gather(predictions, class_indices, axis=1, batch_dims=1)
+    classified = time.perf_counter()
+
+    gradients = tape.gradient(scores, feature_maps)
+    channel_weights = tf.reduce_mean(gradients, axis=(1, 2), keepdims=True)
+    cams = tf.nn.relu(tf.reduce_sum(channel_weights * feature_maps, axis=-1)).numpy()
+    peaks = cams.reshape(len(cams), -1).max(axis=1).reshape(-1, 1, 1)
+    heatmaps = np.round(255 * cams / np.maximum(peaks, 1e-8)).astype(np.uint8)
+    explained = time.perf_counter()
+
+    predictions = predictions.numpy()
+    class_indices = class_indices.numpy()
+    return {
+        'class_indices': class_indices,
+        'confidences': predictions[np.arange(len(predictions)), class_indices],
+        'heatmaps': heatmaps,
+        'classification_ms': (classified - started) * 1000,
+        'explanation_ms': (explained - classified) * 1000,
+    }
+
+
+def encode_heatmap(heatmap):
+    """PNG at feature-map resolution; a few hundred bytes per analysis"""
+    return cv2.imencode('.png', heatmap)[1].tobytes()
+
+
+def render_heatmap(data, size=(256, 256)):
+    """Colourised PNG of a stored heatmap, upsampled for display"""
+    heatmap = cv2.imdecode(np.frombuffer(bytes(data), dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    heatmap = cv2.resize(heatmap, size, interpolation=cv2.INTER_CUBIC)
+    return cv2.imencode('.png', cv2.applyColorMap(heatmap, cv2.COLORMAP_JET))[1].tobytes()
+
+
+class ExplanationBatcher:
+    """Collects concurrent explanation requests and runs them as one batch.
+
+    A request waits at most max_wait seconds for others to join its batch.
+    """
+
+    def __init__(self, grad_model, max_batch_size=8, max_wait=0.01):
+        self.grad_model = grad_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='lesion-explanations', daemon=True)
+        self.thread.start()
+
+    def submit(self, image):
+        future = Future()
+        self.requests.put((image, future, time.perf_counter()))
+        return future
+
+    def explain(self, image):
+        return self.submit(image).result()
+
+    def next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            started = time.perf_counter()
+            try:
+                result = classify_and_explain(self.grad_model, np.stack([item[0] for item in batch]))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for i, (_, future, submitted) in enumerate(batch):
+                future.set_result({
+                    'class_index': int(result['class_indices'][i]),
+                    'confidence': float(result['confidences'][i]),
+                    'heatmap': result['heatmaps'][i],
+                    'classification_ms': result['classification_ms'],
+                    'explanation_ms': result['explanation_ms'],
+                    'queue_ms': (started - submitted) * 1000,
+                    'batch_size': len(batch),
+                })
+
+
+def get_explanation_batcher(classifier):
+    """Batcher for the classifier's model, or None if it cannot be explained"""
+    if not getattr(settings, 'LESION_EXPLANATIONS', True) or classifier.classification_model is None:
+        return None
+    batcher = getattr(classifier, 'explanation_batcher', None)
+    if batcher is None:
+        with _batcher_lock:
+            batcher = getattr(classifier, 'explanation_batcher', None)
+            if batcher is None:
+                try:
+                    batcher = ExplanationBatcher(
+                        build_grad_model(classifier.classification_model),
+                        max_batch_size=getattr(settings, 'LESION_EXPLANATION_BATCH_SIZE', 8),
+                        max_wait=getattr(settings, 'LESION_EXPLANATION_MAX_WAIT_MS', 10) / 1000,
+                    )
+                except Exception as e:
+                    print(f"Explanations disabled: {e}")
+                    batcher = False
+                classifier.explanation_batcher = batcher
+    return batcher or None
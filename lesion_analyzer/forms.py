@@ -1,4 +1,5 @@
 from django import forms
+from django.conf import settings
 from .models import LesionAnalysis
 
 class ImageUploadForm(forms.ModelForm):
@@ -21,4 +22,11 @@ class ImageUploadForm(forms.ModelForm):
                 raise forms.ValidationError("Image file too large. Maximum size is 10MB.")
             if not image.content_type.startswith('image/'):
                 raise forms.ValidationError("File must be an image.")
+            # ImageField has already parsed the header; reject huge images before anything decodes them
+            header = getattr(image, 'image', None)
+            max_pixels = getattr(settings, 'LESION_MAX_IMAGE_PIXELS', 50_000_000)
+            if header is not None and header.size[0] * header.size[1] > max_pixels:
+                raise forms.ValidationError(
+                    f"Image resolution too large. Maximum is {max_pixels / 1_000_000:g} megapixels."
+                )
         return image
\ No newline at end of file
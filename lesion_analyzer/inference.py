@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.files.base import ContentFile
+from django.conf import settings
+import numpy as np
+import threading
+import time
+import io
+
+from .explain import encode_heatmap, get_explanation_batcher
+from .ml_utils import LesionClassifier
+from .morphometrics import compute_lesion_features
+
+_classifier = None
+_classifier_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_classifier():
+    """Process-wide classifier so the models are loaded once, not per request"""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = LesionClassifier()
+    return _classifier
+
+
+def get_inference_executor():
+    """Executor that caps how many analyses run preprocessing and inference at once"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'LESION_INFERENCE_WORKERS', 2),
+                    thread_name_prefix='lesion-inference',
+                )
+    return _executor
+
+
+def classify_with_explanation(classifier, image_path, processed_image=None):
+    """Classify, with a Grad-CAM heatmap from the same forward pass when the model allows it"""
+    batcher = get_explanation_batcher(classifier)
+    if batcher is not None and processed_image is not None:
+        try:
+            explanation = batcher.explain(processed_image.astype(np.float32))
+            predicted_class = classifier.class_names[explanation['class_index']]
+            return predicted_class, explanation['confidence'], explanation
+        except Exception as e:
+            print(f"Error in explanation, classifying without it: {e}")
+
+    started = time.perf_counter()
+    predicted_class, confidence = classifier.classify_lesion(image_path, processed_image)
+    return predicted_class, confidence, {'classification_ms': (time.perf_counter() - started) * 1000}
+
+
+def check_upload_quality(upload, classifier=None):
+    """Quality gate on an uploaded file's bytes, so rejected images are never stored"""
+    classifier = classifier or get_classifier()
+    upload.seek(0)
+    data = upload.read()
+    upload.seek(0)
+    return classifier.check_image_quality(data)
+
+
+def analyze_image(image_path, classifier=None, quality=None):
+    """Run classification and segmentation; touches neither the database nor MEDIA_ROOT.
+
+    Pass the result of check_upload_quality as quality when the gate has already run.
+    """
+    classifier = classifier or get_classifier()
+    if quality is None:
+        # Raises ImageQualityError before any model runs when the gate rejects the image
+        quality = classifier.check_image_quality(image_path)
+    # Preprocess once; classification, segmentation and features all share the array
+    try:
+        processed_image = classifier.load_preprocessed(image_path)
+    except Exception as e:
+        print(f"Error in preprocessing: {e}")
+        processed_image = None
+    predicted_class, confidence, explanation = classify_with_explanation(classifier, image_path, processed_image)
+    mask_image, segmented_image = classifier.generate_segmentation_mask(image_path, processed_image)
+    features = {}
+    if mask_image and segmented_image:
+        # Measured on the preprocessed model-input grid in every segmentation mode,
+        # so tiled (native-resolution) and resized analyses stay comparable
+        features = compute_lesion_features(mask_image, processed_image, reference_size=classifier.target_size)
+    return {
+        'predicted_class': predicted_class,
+        'confidence': confidence,
+        'mask_image': mask_image,
+        'segmented_image': segmented_image,
+        'features': features,
+        'quality': quality,
+        'explanation': explanation,
+    }
+
+
+def save_analysis_result(analysis, result):
+    """Write the mask images to storage and persist the result on the analysis"""
+    analysis.predicted_class = result['predicted_class']
+    analysis.confidence_score = result['confidence']
+
+    if result['mask_image'] and result['segmented_image']:
+        mask_io = io.BytesIO()
+        result['mask_image'].save(mask_io, format='PNG')
+        mask_content = ContentFile(mask_io.getvalue())
+        analysis.segmentation_mask.save(f'mask_{analysis.id}.png', mask_content, save=False)
+
+        segmented_io = io.BytesIO()
+        result['segmented_image'].save(segmented_io, format='PNG')
+        segmented_content = ContentFile(segmented_io.getvalue())
+        analysis.segmented_region.save(f'segmented_{analysis.id}.png', segmented_content, save=False)
+
+    for field, value in result['features'].items():
+        setattr(analysis, field, value)
+
+    quality = result.get('quality')
+    if quality:
+        analysis.quality_sharpness = quality['sharpness']
+        analysis.quality_brightness = quality['brightness']
+        analysis.quality_clipped_fraction = quality['clipped_fraction']
+        analysis.quality_skin_coverage = quality['skin_coverage']
+        analysis.quality_issues = '; '.join(quality['issues'])
+
+    explanation = result.get('explanation') or {}
+    analysis.classification_ms = explanation.get('classification_ms')
+    analysis.explanation_ms = explanation.get('explanation_ms')
+    if explanation.get('heatmap') is not None:
+        analysis.explanation_heatmap = encode_heatmap(explanation['heatmap'])
+
+    analysis.save()
+    return analysis
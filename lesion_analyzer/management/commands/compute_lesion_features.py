@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from PIL import Image
+import numpy as np
+
+from lesion_analyzer.ml_utils import LesionClassifier
+from lesion_analyzer.models import LesionAnalysis
+from lesion_analyzer.morphometrics import FEATURE_FIELDS, compute_lesion_features, resolution_label
+
+
+class Command(BaseCommand):
+    help = 'Compute lesion morphometrics from stored segmentation masks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recompute', action='store_true',
+                            help='Recompute features for rows already measured on the current grid')
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Rows fetched per query and written per bulk update')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        # Preprocessing only: features use the same grid and pixels as live analyses
+        classifier = LesionClassifier(load_models=False)
+        reference_size = classifier.target_size
+        queryset = LesionAnalysis.objects.exclude(segmentation_mask='').exclude(segmentation_mask__isnull=True)
+        if not options['recompute']:
+            queryset = queryset.filter(
+                Q(lesion_area__isnull=True) | ~Q(feature_resolution=resolution_label(reference_size))
+            )
+        queryset = queryset.order_by('id').only('id', 'image', 'segmentation_mask')
+
+        pending = []
+        updated = 0
+        failed = 0
+        for analysis in queryset.iterator(chunk_size=chunk_size):
+            try:
+                with Image.open(analysis.segmentation_mask.path) as mask_file:
+                    mask = np.array(mask_file.convert('L'))
+                image = None
+                if analysis.image:
+                    image = classifier.load_preprocessed(analysis.image.path)
+                features = compute_lesion_features(mask, image, reference_size=reference_size)
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f'Analysis {analysis.id}: {e}')
+                continue
+
+            for field, value in features.items():
+                setattr(analysis, field, value)
+            pending.append(analysis)
+            if len(pending) >= chunk_size:
+                LesionAnalysis.objects.bulk_update(pending, FEATURE_FIELDS)
+                updated += len(pending)
+                pending = []
+
+        if pending:
+            LesionAnalysis.objects.bulk_update(pending, FEATURE_FIELDS)
+            updated += len(pending)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} analyses ({failed} failed)'))
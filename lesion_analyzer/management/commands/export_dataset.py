@@ -0,0 +1,136 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from django.core.management.base import BaseCommand, CommandError
+import multiprocessing
+import numpy as np
+import json
+import time
+import os
+
+from lesion_analyzer.dataset_export import export_shard, init_worker
+from lesion_analyzer.models import LesionAnalysis
+
+STATE_FILENAME = 'export_state.json'
+
+
+class Command(BaseCommand):
+    help = 'Export analyses as sharded training data (WebDataset-style tar or TFRecord)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir', help='Directory the shards are written to')
+        parser.add_argument('--format', choices=['tar', 'tfrecord'], default='tar')
+        parser.add_argument('--shard-size', type=int, default=1000,
+                            help='Samples per shard')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Rows fetched per database query')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Parallel shard writers')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore saved progress and export from the first row')
+
+    def load_state(self, state_path, restart):
+        if restart or not os.path.exists(state_path):
+            return {'last_id': 0, 'next_shard': 0}
+        with open(state_path) as state_file:
+            return json.load(state_file)
+
+    def save_state(self, state_path, state):
+        tmp_path = state_path + '.tmp'
+        with open(tmp_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(tmp_path, state_path)
+
+    def handle(self, *args, **options):
+        output_dir = options['output_dir']
+        shard_size = options['shard_size']
+        workers = max(options['workers'], 1)
+        if shard_size < 1:
+            raise CommandError('--shard-size must be at least 1')
+        os.makedirs(output_dir, exist_ok=True)
+
+        state_path = os.path.join(output_dir, STATE_FILENAME)
+        state = self.load_state(state_path, options['restart'])
+        if state['last_id']:
+            self.stdout.write(f"Resuming after analysis {state['last_id']}")
+
+        queryset = (
+            LesionAnalysis.objects
+            .filter(id__gt=state['last_id'])
+            .exclude(image='').exclude(image__isnull=True)
+            .order_by('id')
+            .only('id', 'image', 'segmentation_mask', 'predicted_class', 'confidence_score')
+        )
+
+        # Shards can finish out of order; progress only advances over a contiguous prefix
+        finished = {}
+        shard_sizes = []
+        totals = {'samples': 0, 'bytes': 0, 'errors': 0}
+        started = time.monotonic()
+
+        def collect(done_futures):
+            for future in done_futures:
+                result = future.result()
+                finished[result['shard_index']] = result
+                shard_sizes.append(result['bytes'])
+                totals['samples'] += result['samples']
+                totals['bytes'] += result['bytes']
+                totals['errors'] += len(result['errors'])
+                for error in result['errors']:
+                    self.stderr.write(error)
+                self.stdout.write(
+                    f"Wrote {os.path.basename(result['path'])}: "
+                    f"{result['samples']} samples, {result['bytes'] / 1e6:.1f} MB"
+                )
+            while state['next_shard'] in finished:
+                state['last_id'] = finished.pop(state['next_shard'])['last_id']
+                state['next_shard'] += 1
+            self.save_state(state_path, state)
+
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker) as executor:
+            in_flight = set()
+            shard_index = state['next_shard']
+            rows = []
+
+            def submit(rows, shard_index):
+                in_flight.add(executor.submit(
+                    export_shard, shard_index, rows, output_dir, options['format']
+                ))
+                # Bound the rows held in memory to a couple of shards per worker
+                if len(in_flight) >= workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    in_flight.difference_update(done)
+                    collect(done)
+
+            for analysis in queryset.iterator(chunk_size=options['chunk_size']):
+                rows.append({
+                    'id': analysis.id,
+                    'image_path': analysis.image.path,
+                    'mask_path': analysis.segmentation_mask.path if analysis.segmentation_mask else None,
+                    'label': analysis.predicted_class,
+                    'confidence': analysis.confidence_score or 0.0,
+                })
+                if len(rows) == shard_size:
+                    submit(rows, shard_index)
+                    shard_index += 1
+                    rows = []
+            if rows:
+                submit(rows, shard_index)
+
+            done, _ = wait(in_flight)
+            collect(done)
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {totals['samples']} samples in {len(shard_sizes)} shards "
+            f"({totals['errors']} failed) in {elapsed:.1f}s"
+        ))
+        if shard_sizes:
+            self.stdout.write(
+                f"Throughput: {totals['samples'] / elapsed:.1f} samples/s, "
+                f"{totals['bytes'] / 1e6 / elapsed:.1f} MB/s"
+            )
+            self.stdout.write(
+                f"Shard size: min {min(shard_sizes) / 1e6:.1f} MB, "
+                f"mean {np.mean(shard_sizes) / 1e6:.1f} MB, "
+                f"max {max(shard_sizes) / 1e6:.1f} MB"
+            )
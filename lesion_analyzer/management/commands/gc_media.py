@@ -0,0 +1,212 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+import time
+import os
+
+from lesion_analyzer.models import LesionAnalysis
+from lesion_analyzer.page_cache import deferred_dashboard_invalidation
+
+FILE_FIELDS = ('image', 'segmentation_mask', 'segmented_region')
+MEDIA_DIRS = ('uploads', 'masks', 'regions')
+
+
+def remove_files(paths, dry_run):
+    """Delete a batch of files; returns (files removed, bytes reclaimed, errors)"""
+    removed = 0
+    reclaimed = 0
+    errors = []
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+            removed += 1
+            reclaimed += size
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            errors.append(f'{path}: {e}')
+    return removed, reclaimed, errors
+
+
+class Command(BaseCommand):
+    help = 'Apply the analysis retention policy and delete media files no analysis references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=int,
+                            help='Delete analyses older than this many days')
+        parser.add_argument('--keep-latest', type=int,
+                            help='Keep only this many of the newest analyses')
+        parser.add_argument('--grace-minutes', type=int, default=60,
+                            help='Never treat files modified more recently than this as orphans')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Rows or files handled per query and per delete batch')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Threads deleting files in parallel')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be deleted without deleting anything')
+
+    def handle(self, *args, **options):
+        if options['keep_latest'] is not None and options['keep_latest'] < 0:
+            raise CommandError('--keep-latest cannot be negative')
+        self.dry_run = options['dry_run']
+        self.chunk_size = options['chunk_size']
+        self.media_root = os.path.abspath(settings.MEDIA_ROOT)
+        self.totals = {'rows': 0, 'files': 0, 'bytes': 0, 'errors': 0}
+        started = time.monotonic()
+
+        self.workers = max(options['workers'], 1)
+        self.pending = []
+        self.futures = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            self.executor = executor
+            with deferred_dashboard_invalidation():
+                self.apply_retention(options['max_age_days'], options['keep_latest'])
+            # Finish retention deletes first so the walk does not see those files again
+            self.drain()
+            self.collect_orphans(options['grace_minutes'])
+            self.drain()
+
+        if not self.dry_run:
+            self.prune_empty_dirs()
+
+        verb = 'Would delete' if self.dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {self.totals['rows']} analyses and {self.totals['files']} files, "
+            f"reclaiming {self.totals['bytes'] / 1e6:.1f} MB "
+            f"({self.totals['errors']} errors) in {time.monotonic() - started:.1f}s"
+        ))
+
+    def expired_queryset(self, max_age_days, keep_latest):
+        conditions = Q()
+        if max_age_days is not None:
+            conditions |= Q(created_at__lt=timezone.now() - timedelta(days=max_age_days))
+        if keep_latest is not None:
+            boundary = (
+                LesionAnalysis.objects.order_by('-created_at', '-id')
+                .values_list('created_at', 'id')[keep_latest:keep_latest + 1]
+            )
+            boundary = list(boundary)
+            if boundary:
+                created_at, analysis_id = boundary[0]
+                # Everything at or past the first row beyond the newest keep_latest
+                conditions |= Q(created_at__lt=created_at) | Q(created_at=created_at, id__lte=analysis_id)
+        if not conditions:
+            return LesionAnalysis.objects.none()
+        return LesionAnalysis.objects.filter(conditions)
+
+    def apply_retention(self, max_age_days, keep_latest):
+        """Bulk-delete expired rows chunk by chunk and queue their files"""
+        expired = self.expired_queryset(max_age_days, keep_latest).order_by('id')
+        last_id = 0
+        while True:
+            # Keyset pagination, so deleting rows never shifts the next chunk
+            chunk = list(expired.filter(id__gt=last_id).values_list('id', *FILE_FIELDS)[:self.chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            ids = [row[0] for row in chunk]
+            if not self.dry_run:
+                # Queryset delete skips LesionAnalysis.delete; files are removed below.
+                # The dashboard signal rules out a fast delete, so load only the ids
+                LesionAnalysis.objects.filter(id__in=ids).only('id').delete()
+            self.totals['rows'] += len(ids)
+            for row in chunk:
+                self.queue([self.media_path(name) for name in row[1:] if name])
+
+    def collect_orphans(self, grace_minutes):
+        """Walk the media tree and queue files no row references"""
+        cutoff = time.time() - grace_minutes * 60
+        batch = []
+        for media_dir in MEDIA_DIRS:
+            for path in self.walk(os.path.join(self.media_root, media_dir)):
+                batch.append(path)
+                if len(batch) >= self.chunk_size:
+                    self.queue_unreferenced(batch, cutoff)
+                    batch = []
+        if batch:
+            self.queue_unreferenced(batch, cutoff)
+
+    def queue_unreferenced(self, paths, cutoff):
+        names = {self.media_name(path): path for path in paths}
+        lookup = Q()
+        for field in FILE_FIELDS:
+            lookup |= Q(**{f'{field}__in': list(names)})
+        referenced = set()
+        for row in LesionAnalysis.objects.filter(lookup).values_list(*FILE_FIELDS).iterator():
+            referenced.update(row)
+
+        orphans = []
+        for name, path in names.items():
+            if name in referenced:
+                continue
+            try:
+                # Skip files an in-progress upload may still be about to reference
+                if os.path.getmtime(path) > cutoff:
+                    continue
+            except OSError:
+                continue
+            orphans.append(path)
+        if self.dry_run and orphans:
+            for path in orphans:
+                self.stdout.write(f'Orphan: {self.media_name(path)}')
+        self.queue(orphans)
+
+    def walk(self, directory):
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from self.walk(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry.path
+
+    def media_path(self, name):
+        return os.path.join(self.media_root, *name.split('/'))
+
+    def media_name(self, path):
+        return os.path.relpath(path, self.media_root).replace(os.sep, '/')
+
+    def queue(self, paths):
+        self.pending.extend(paths)
+        while len(self.pending) >= self.chunk_size:
+            self.submit(self.pending[:self.chunk_size])
+            self.pending = self.pending[self.chunk_size:]
+
+    def submit(self, paths):
+        self.futures.append(self.executor.submit(remove_files, paths, self.dry_run))
+        # Keep at most a few batches outstanding per worker
+        if len(self.futures) >= self.workers * 2:
+            self.collect(self.futures.pop(0))
+
+    def collect(self, future):
+        removed, reclaimed, errors = future.result()
+        self.totals['files'] += removed
+        self.totals['bytes'] += reclaimed
+        self.totals['errors'] += len(errors)
+        for error in errors:
+            self.stderr.write(error)
+
+    def drain(self):
+        if self.pending:
+            self.submit(self.pending)
+            self.pending = []
+        for future in self.futures:
+            self.collect(future)
+        self.futures = []
+
+    def prune_empty_dirs(self):
+        """Remove date directories under uploads/ left empty by the deletes"""
+        uploads = os.path.join(self.media_root, 'uploads')
+        for directory, subdirs, files in os.walk(uploads, topdown=False):
+            if directory != uploads and not os.listdir(directory):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
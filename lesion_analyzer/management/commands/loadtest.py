@@ -0,0 +1,275 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connection
+from django.test.utils import override_settings
+import numpy as np
+import requests
+import threading
+import tempfile
+import random
+import shutil
+import json
+import time
+import cv2
+import re
+import os
+
+from lesion_analyzer import admission, inference
+from lesion_analyzer.ml_utils import LesionClassifier
+
+ENDPOINTS = ('upload', 'history', 'home', 'results', 'delete')
+DEFAULT_MIX = 'upload=2,history=4,home=2,results=1,delete=1'
+
+
+class StandInModel:
+    """Replaces a Keras model with a fixed-latency, deterministic predict()"""
+
+    def __init__(self, kind, latency, num_classes=8):
+        self.kind = kind
+        self.latency = latency
+        self.num_classes = num_classes
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        time.sleep(self.latency)
+        if self.kind == 'segmentation':
+            return (batch.mean(axis=-1, keepdims=True) < 128).astype(np.float32)
+        predictions = np.full((len(batch), self.num_classes), 0.5 / (self.num_classes - 1), dtype=np.float32)
+        predictions[:, 4] = 0.5
+        return predictions
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise CommandError(f"Unknown endpoint '{name}'; choose from {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile_report(latencies, elapsed):
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests': int(len(latencies)),
+        'throughput_rps': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+    }
+
+
+class LoadTest:
+    """Virtual users replaying a weighted endpoint mix against a live server"""
+
+    def __init__(self, base_url, image_bytes, weights, seed):
+        self.base_url = base_url
+        self.image_bytes = image_bytes
+        self.names = list(weights)
+        self.weights = [weights[name] for name in self.names]
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.analysis_ids = []
+        self.ids_lock = threading.Lock()
+        self.local = threading.local()
+        self.results = []
+        self.results_lock = threading.Lock()
+
+    def session(self):
+        # One session per worker thread, primed with a CSRF cookie
+        if not hasattr(self.local, 'session'):
+            session = requests.Session()
+            session.get(f'{self.base_url}/upload/')
+            self.local.session = session
+        return self.local.session
+
+    def choose(self):
+        with self.random_lock:
+            return self.random.choices(self.names, self.weights)[0]
+
+    def run_one(self, endpoint, scheduled=None):
+        session = self.session()
+        started = time.monotonic()
+        endpoint, status = self.request(session, endpoint)
+        finished = time.monotonic()
+        with self.results_lock:
+            # Open-loop runs measure from the scheduled arrival, so queueing counts
+            self.results.append((endpoint, status, finished - (scheduled or started)))
+
+    def request(self, session, endpoint):
+        """Send one request; returns the endpoint actually hit and its status.
+
+        delete and results fall back to upload and history when no analysis exists yet.
+        """
+        headers = {'X-CSRFToken': session.cookies.get('csrftoken', '')}
+        try:
+            if endpoint == 'delete':
+                with self.ids_lock:
+                    analysis_id = self.analysis_ids.pop() if self.analysis_ids else None
+                if analysis_id is None:
+                    endpoint = 'upload'
+                else:
+                    headers['X-Requested-With'] = 'XMLHttpRequest'
+                    response = session.post(f'{self.base_url}/delete-analysis/{analysis_id}/', headers=headers)
+                    return endpoint, response.status_code
+            if endpoint == 'results':
+                with self.ids_lock:
+                    analysis_id = self.analysis_ids[-1] if self.analysis_ids else None
+                if analysis_id is None:
+                    endpoint = 'history'
+                else:
+                    return endpoint, session.get(f'{self.base_url}/results/{analysis_id}/').status_code
+            if endpoint == 'upload':
+                response = session.post(
+                    f'{self.base_url}/upload/', headers=headers, allow_redirects=False,
+                    files={'image': ('lesion.jpg', self.image_bytes, 'image/jpeg')},
+                )
+                match = re.search(r'/results/(\d+)/', response.headers.get('Location', ''))
+                if match:
+                    with self.ids_lock:
+                        self.analysis_ids.append(int(match.group(1)))
+                return endpoint, response.status_code
+            if endpoint == 'history':
+                return endpoint, session.get(f'{self.base_url}/history/').status_code
+            return endpoint, session.get(f'{self.base_url}/').status_code
+        except requests.RequestException:
+            return endpoint, 'error'
+
+
+class Command(BaseCommand):
+    help = 'Load-test the app against a temporary database and MEDIA_ROOT with stand-in models'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests to send')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent virtual users')
+        parser.add_argument('--rate', type=float,
+                            help='Open-loop arrival rate in requests per second (default: closed loop)')
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f'Weighted endpoint mix (default: {DEFAULT_MIX})')
+        parser.add_argument('--model-latency', type=float, default=50,
+                            help='Milliseconds each stand-in model predict() takes')
+        parser.add_argument('--image-size', type=int, default=1024, help='Side of the uploaded test image')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the request mix and arrivals')
+        parser.add_argument('--output', help='Also write the report as JSON to this file')
+
+    def handle(self, *args, **options):
+        weights = parse_mix(options['mix'])
+        workdir = tempfile.mkdtemp(prefix='lesion-loadtest-')
+        overrides = {
+            'DEBUG': False,
+            'ALLOWED_HOSTS': ['127.0.0.1', 'localhost'],
+            'MEDIA_ROOT': os.path.join(workdir, 'media'),
+            'LESION_PREPROCESS_CACHE_DIR': os.path.join(workdir, 'preprocessed'),
+            'CACHES': {'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': os.path.join(workdir, 'cache'),
+            }},
+        }
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(workdir, 'db.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(**overrides):
+                report = self.run_load(options, weights)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        self.print_report(report)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(report, output_file, indent=2)
+
+    def stand_in_classifier(self, latency):
+        classifier = LesionClassifier(load_models=False)
+        classifier.model_errors = []
+        classifier.classification_model = StandInModel('classification', latency, len(classifier.class_names))
+        classifier.segmentation_model = StandInModel('segmentation', latency)
+        return classifier
+
+    def test_image(self, size, seed):
+        rng = np.random.default_rng(seed)
+        image = rng.integers(150, 230, (size, size, 3), dtype=np.uint8)
+        cv2.circle(image, (size // 2, size // 2), size // 4, (60, 40, 30), -1)
+        return cv2.imencode('.jpg', image)[1].tobytes()
+
+    def run_load(self, options, weights):
+        inference._classifier = self.stand_in_classifier(options['model_latency'] / 1000)
+        admission._controller = None
+
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+        server.daemon_threads = True
+        server.set_app(WSGIHandler())
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+        test = LoadTest(base_url, self.test_image(options['image_size'], options['seed']),
+                        weights, options['seed'])
+        schedule = [test.choose() for _ in range(options['requests'])]
+        arrivals = None
+        if options['rate']:
+            rng = random.Random(options['seed'])
+            arrivals = np.cumsum([rng.expovariate(options['rate']) for _ in schedule])
+
+        self.stdout.write(f"Sending {len(schedule)} requests to {base_url} "
+                          f"({'%.1f req/s open loop' % options['rate'] if options['rate'] else 'closed loop'}, "
+                          f"concurrency {options['concurrency']})")
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                futures = []
+                for index, endpoint in enumerate(schedule):
+                    if arrivals is None:
+                        futures.append(executor.submit(test.run_one, endpoint))
+                        continue
+                    scheduled = started + arrivals[index]
+                    delay = scheduled - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    futures.append(executor.submit(test.run_one, endpoint, scheduled))
+                for future in futures:
+                    future.result()
+            elapsed = time.monotonic() - started
+        finally:
+            server.shutdown()
+            server.server_close()
+            inference._classifier = None
+            admission._controller = None
+
+        report = {
+            'settings': {key: options[key] for key in (
+                'requests', 'concurrency', 'rate', 'mix', 'model_latency', 'image_size', 'seed')},
+            'elapsed_seconds': elapsed,
+            'overall': percentile_report([r[2] for r in test.results], elapsed),
+            'endpoints': {},
+        }
+        for endpoint in ENDPOINTS:
+            results = [r for r in test.results if r[0] == endpoint]
+            if not results:
+                continue
+            statuses = {}
+            for _, status, _ in results:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            report['endpoints'][endpoint] = percentile_report([r[2] for r in results], elapsed)
+            report['endpoints'][endpoint]['statuses'] = statuses
+        return report
+
+    def print_report(self, report):
+        self.stdout.write(f"{'endpoint':<10}{'count':>7}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}"
+                          f"{'p99 ms':>10}{'max ms':>10}  statuses")
+        rows = list(report['endpoints'].items()) + [('overall', report['overall'])]
+        for name, stats in rows:
+            statuses = ' '.join(f'{code}:{count}' for code, count in sorted(stats.get('statuses', {}).items()))
+            self.stdout.write(
+                f"{name:<10}{stats['requests']:>7}{stats['throughput_rps']:>9.1f}{stats['p50_ms']:>10.1f}"
+                f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}  {statuses}"
+            )
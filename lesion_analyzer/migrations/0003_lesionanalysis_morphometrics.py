@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lesion_analyzer', '0002_lesionanalysis_segmented_region_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='asymmetry_score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='border_irregularity',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='color_variance',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='diameter_px',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='lesion_area',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='lesion_perimeter',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lesion_analyzer', '0003_lesionanalysis_morphometrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='quality_brightness',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='quality_clipped_fraction',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='quality_issues',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='quality_sharpness',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='quality_skin_coverage',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lesion_analyzer', '0004_lesionanalysis_quality'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='classification_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='explanation_heatmap',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='explanation_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
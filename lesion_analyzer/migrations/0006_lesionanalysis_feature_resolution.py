@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lesion_analyzer', '0005_lesionanalysis_explanation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesionanalysis',
+            name='feature_resolution',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
@@ -1,13 +1,30 @@
 import numpy as np
 import cv2
 from PIL import Image
-import tensorflow as tf
 from django.conf import settings
+import zipfile
+import hashlib
+import json
 import os
 import math
+import io
+
+from .model_metadata import input_size, read_model_metadata
+from .preprocess_cache import PreprocessCache, content_hash
+
+# Bump when preprocessing changes in a way not captured by its parameters
+PREPROCESS_VERSION = 1
+
+class ImageQualityError(Exception):
+    """Raised when an image fails the quality gate and is not worth running the models on"""
+
+    def __init__(self, quality):
+        super().__init__('; '.join(quality['issues']))
+        self.quality = quality
+
 
 class LesionClassifier:
-    def __init__(self):
+    def __init__(self, load_models=True):
         self.classification_model_path = 'models/50_efficientnet_model_bal.keras'
         self.segmentation_model_path = 'models/50_epochs_BCDUnet_model.keras'
 
@@ -21,9 +38,83 @@ class LesionClassifier:
         ]
 
         self.model_input_size = None
-        self.load_models()
+        self.classification_metadata = None
+        self.segmentation_metadata = None
+        self.model_errors = self.inspect_models()
+        self.clahe_clip_limit = 2.0
+        self.clahe_tile_grid = (8, 8)
+        self.hair_kernel_size = 17
+        self.hair_threshold = 10
+        self.max_image_pixels = getattr(settings, 'LESION_MAX_IMAGE_PIXELS', 50_000_000)
+        self.reduced_decode = getattr(settings, 'LESION_REDUCED_DECODE', True)
+        self.quality_mode = getattr(settings, 'LESION_QUALITY_MODE', 'reject')
+        self.quality_size = 256
+        self.min_sharpness = getattr(settings, 'LESION_QUALITY_MIN_SHARPNESS', 25.0)
+        self.min_brightness = getattr(settings, 'LESION_QUALITY_MIN_BRIGHTNESS', 40.0)
+        self.max_brightness = getattr(settings, 'LESION_QUALITY_MAX_BRIGHTNESS', 220.0)
+        self.max_clipped_fraction = getattr(settings, 'LESION_QUALITY_MAX_CLIPPED', 0.5)
+        self.min_skin_coverage = getattr(settings, 'LESION_QUALITY_MIN_SKIN_COVERAGE', 0.5)
+        self.preprocess_cache = None
+        cache_dir = getattr(settings, 'LESION_PREPROCESS_CACHE_DIR', None)
+        if cache_dir:
+            self.preprocess_cache = PreprocessCache(
+                cache_dir, self.preprocess_fingerprint(), shape=self.target_size + (3,),
+                max_bytes=getattr(settings, 'LESION_PREPROCESS_CACHE_MAX_BYTES', 2 * 1024 ** 3),
+            )
+        self.segmentation_mode = getattr(settings, 'LESION_SEGMENTATION_MODE', 'resize')
+        self.tile_overlap = getattr(settings, 'LESION_SEGMENTATION_TILE_OVERLAP', 64)
+        self.tile_batch_size = getattr(settings, 'LESION_SEGMENTATION_TILE_BATCH_SIZE', 8)
+        if load_models:
+            self.load_models()
+
+    @property
+    def target_size(self):
+        return self.model_input_size or (256, 256)
+
+    def inspect_models(self):
+        """Read shapes from the model archives and check them before anything is loaded.
+
+        Returns the mismatches that make the models unusable with this pipeline.
+        """
+        errors = []
+        try:
+            self.classification_metadata = read_model_metadata(self.classification_model_path)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            print(f"Could not read classification model metadata: {e}")
+        try:
+            self.segmentation_metadata = read_model_metadata(self.segmentation_model_path)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            print(f"Could not read segmentation model metadata: {e}")
+
+        if self.classification_metadata:
+            self.model_input_size = input_size(self.classification_metadata)
+            shape = (self.classification_metadata['input_shapes'] or [None])[0]
+            if shape and shape[-1] != 3:
+                errors.append(f"Classification model expects {shape[-1]} channels, not 3")
+            output = (self.classification_metadata['output_shapes'] or [None])[0]
+            if output and output[-1] != len(self.class_names):
+                errors.append(
+                    f"Classification model outputs {output[-1]} classes, expected {len(self.class_names)}"
+                )
+        if self.segmentation_metadata:
+            segmentation_size = input_size(self.segmentation_metadata)
+            if self.model_input_size is None:
+                self.model_input_size = segmentation_size
+            elif segmentation_size and segmentation_size != self.model_input_size:
+                # Both models are fed the same preprocessed image
+                errors.append(
+                    f"Segmentation input {segmentation_size} does not match classification input "
+                    f"{self.model_input_size}"
+                )
+        return errors
 
     def load_models(self):
+        if self.model_errors:
+            for error in self.model_errors:
+                print(f"Model validation failed: {error}")
+            return
+        # Imported here so preprocessing-only users (export workers) never start TensorFlow
+        import tensorflow as tf
         try:
             self.classification_model = tf.keras.models.load_model(
                 self.classification_model_path, compile=False
@@ -71,7 +162,7 @@ class LesionClassifier:
 
     def apply_clahe(self, red_img_arr):
         image_lab = cv2.cvtColor(red_img_arr, cv2.COLOR_BGR2LAB)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        clahe = cv2.createCLAHE(clipLimit=self.clahe_clip_limit, tileGridSize=self.clahe_tile_grid)
         colorimage_l = clahe.apply(image_lab[:, :, 0])
         colorimage_clahe = np.stack(
             (colorimage_l, image_lab[:, :, 1], image_lab[:, :, 2]), axis=2
@@ -81,24 +172,133 @@ class LesionClassifier:
 
     def Hair_removal(self, image_clahe):
         grayScale = cv2.cvtColor(image_clahe, cv2.COLOR_RGB2GRAY)
-        kernel = cv2.getStructuringElement(1, (17, 17))
+        kernel = cv2.getStructuringElement(1, (self.hair_kernel_size, self.hair_kernel_size))
         blackhat = cv2.morphologyEx(grayScale, cv2.MORPH_BLACKHAT, kernel)
-        ret, thresh2 = cv2.threshold(blackhat, 10, 255, cv2.THRESH_BINARY)
+        ret, thresh2 = cv2.threshold(blackhat, self.hair_threshold, 255, cv2.THRESH_BINARY)
         dst = cv2.inpaint(image_clahe, thresh2, 1, cv2.INPAINT_TELEA)
         return Image.fromarray(dst)
 
-    def preprocess_image(self, image_path, target_size=(256, 256)):
-        image = cv2.imread(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    def decode_image(self, image, target_size=None, reduce=True):
+        """Decode a path or encoded bytes to RGB, letting libjpeg downscale in the DCT domain when large"""
+        in_memory = isinstance(image, (bytes, bytearray, memoryview))
+        # Opening with PIL only parses the header, so oversized images are rejected before decoding
+        with Image.open(io.BytesIO(image) if in_memory else image) as header:
+            width, height = header.size
+            image_format = header.format
+        if width * height > self.max_image_pixels:
+            raise ValueError(f'Image is {width}x{height}; the maximum is {self.max_image_pixels} pixels')
+        target_size = target_size or self.target_size
+
+        flag = cv2.IMREAD_COLOR
+        if reduce and self.reduced_decode and image_format == 'JPEG':
+            # Largest reduction that still leaves at least target_size pixels in either orientation
+            shortest_side = min(width, height)
+            for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                                         (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                if shortest_side // factor >= max(target_size):
+                    flag = reduced_flag
+                    break
+
+        if in_memory:
+            decoded = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), flag)
+        else:
+            decoded = cv2.imread(image, flag)
+        if decoded is None:
+            raise ValueError('Could not decode image' if in_memory else f'Could not decode image {image}')
+        return cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB)
+
+    def preprocess_image(self, image_path, target_size=None):
+        target_size = target_size or self.target_size
+        image = self.decode_image(image_path, target_size)
         image = self.bl_resize(image, target_size[0], target_size[1])
         image_clahe = self.apply_clahe(image)
         image = self.Hair_removal(image_clahe)
         return np.array(image)
 
-    def classify_lesion(self, image_path):
+    def assess_image_quality(self, image):
+        """Blur, exposure and skin-coverage checks on a small decoded copy; takes milliseconds"""
+        image = self.decode_image(image, (self.quality_size, self.quality_size))
+        scale = self.quality_size / max(image.shape[:2])
+        if scale < 1:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        brightness = float(gray.mean())
+        histogram = np.bincount(gray.ravel(), minlength=256) / gray.size
+        bright_fraction = float(histogram[246:].sum())
+        clipped_fraction = float(histogram[:10].sum()) + bright_fraction
+
+        # Dermoscopy spans reds, browns and blue-grey structures, so count the colours skin
+        # cannot be instead: saturated greens and strongly saturated blues. Vignetting is ignored.
+        hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+        hue, saturation = hsv[:, :, 0], hsv[:, :, 1]
+        non_skin = (((hue >= 35) & (hue < 85) & (saturation >= 60))
+                    | ((hue >= 85) & (hue <= 130) & (saturation >= 150)))
+        lit = gray >= 10
+        skin_coverage = float(1 - (non_skin & lit).sum() / max(lit.sum(), 1))
+
+        issues = []
+        if sharpness < self.min_sharpness:
+            issues.append('Image is too blurry')
+        if brightness < self.min_brightness:
+            issues.append('Image is underexposed')
+        elif brightness > self.max_brightness:
+            issues.append('Image is overexposed')
+        # Only the bright end counts: black dermatoscope corners are expected, not blown out
+        if bright_fraction > self.max_clipped_fraction:
+            issues.append('Too much of the image is blown out')
+        if skin_coverage < self.min_skin_coverage:
+            issues.append('Image does not appear to show skin')
+
+        return {
+            'sharpness': sharpness,
+            'brightness': brightness,
+            'clipped_fraction': clipped_fraction,
+            'skin_coverage': skin_coverage,
+            'issues': issues,
+        }
+
+    def check_image_quality(self, image):
+        """Quality metrics for an image path or encoded bytes, raising ImageQualityError in 'reject' mode"""
+        if self.quality_mode == 'off':
+            return None
+        quality = self.assess_image_quality(image)
+        if quality['issues'] and self.quality_mode == 'reject':
+            raise ImageQualityError(quality)
+        return quality
+
+    def preprocess_fingerprint(self):
+        """Identifies the preprocessing output; cached arrays are discarded when it changes"""
+        params = {
+            'version': PREPROCESS_VERSION,
+            'target_size': list(self.target_size),
+            'clahe_clip_limit': self.clahe_clip_limit,
+            'clahe_tile_grid': list(self.clahe_tile_grid),
+            'hair_kernel_size': self.hair_kernel_size,
+            'hair_threshold': self.hair_threshold,
+            'reduced_decode': self.reduced_decode,
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def load_preprocessed(self, image_path):
+        """preprocess_image, served from the on-disk cache when one is configured"""
+        if self.preprocess_cache is None:
+            return self.preprocess_image(image_path)
+        key = content_hash(image_path)
+        cached = self.preprocess_cache.get(key)
+        if cached is not None:
+            return cached
+        processed_image = self.preprocess_image(image_path)
+        self.preprocess_cache.put(key, processed_image)
+        return processed_image
+
+    def classify_lesion(self, image_path, processed_image=None):
         try:
-            processed_image = self.preprocess_image(image_path).astype(np.float32)
-            processed_image = np.expand_dims(processed_image, axis=0)
+            if processed_image is None:
+                processed_image = self.load_preprocessed(image_path)
+            processed_image = np.expand_dims(processed_image.astype(np.float32), axis=0)
             predictions = self.classification_model.predict(processed_image, verbose=0)
             predicted_class_idx = np.argmax(predictions[0])
             confidence = float(predictions[0][predicted_class_idx])
@@ -108,9 +308,12 @@ class LesionClassifier:
             print(f"Error in classification: {e}")
             return 'Error', 0.0
 
-    def generate_segmentation_mask(self, image_path):
+    def generate_segmentation_mask(self, image_path, processed_image=None):
+        if self.segmentation_mode == 'tiled':
+            return self.generate_tiled_segmentation_mask(image_path)
         try:
-            processed_image = self.preprocess_image(image_path)
+            if processed_image is None:
+                processed_image = self.load_preprocessed(image_path)
             img_for_model = np.expand_dims(processed_image, axis=0)
             predictions = self.segmentation_model.predict(img_for_model, batch_size=1, verbose=0)
             predictions = np.where(predictions > 0.5, 1, 0).astype(np.uint8) * 255
@@ -125,3 +328,79 @@ class LesionClassifier:
         except Exception as e:
             print(f"Error in segmentation: {e}")
             return None, None
+
+
+    def tile_positions(self, length, tile_size, stride):
+        """Start offsets covering [0, length) with tiles of tile_size"""
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size)
+        return positions
+
+    def blend_window(self, tile_size, overlap):
+        """Separable linear ramp so overlapping tiles fade into each other"""
+        ramp = np.minimum(np.arange(1, tile_size + 1), np.arange(tile_size, 0, -1))
+        ramp = np.clip(ramp / max(overlap, 1), 0, 1).astype(np.float32)
+        return np.outer(ramp, ramp)
+
+    def iter_tile_batches(self, image, positions, tile_size, batch_size):
+        """Yield (coords, batch) with at most batch_size preprocessed tiles at a time"""
+        coords, tiles = [], []
+        for y, x in positions:
+            tile = image[y:y + tile_size, x:x + tile_size]
+            tile_clahe = self.apply_clahe(np.ascontiguousarray(tile))
+            tiles.append(np.array(self.Hair_removal(tile_clahe)))
+            coords.append((y, x))
+            if len(tiles) == batch_size:
+                yield coords, np.stack(tiles)
+                coords, tiles = [], []
+        if tiles:
+            yield coords, np.stack(tiles)
+
+    def generate_tiled_segmentation_mask(self, image_path, tile_size=None):
+        """Segment the image at native resolution over overlapping tiles"""
+        tile_size = tile_size or self.target_size[0]
+        try:
+            image = self.decode_image(image_path, reduce=False)
+            height, width = image.shape[:2]
+
+            # Reflect-pad images smaller than one tile so every tile is full size
+            pad_h = max(tile_size - height, 0)
+            pad_w = max(tile_size - width, 0)
+            padded = image
+            if pad_h or pad_w:
+                padded = cv2.copyMakeBorder(image, 0, pad_h, 0, pad_w, cv2.BORDER_REFLECT_101)
+            padded_h, padded_w = padded.shape[:2]
+
+            overlap = min(self.tile_overlap, tile_size // 2)
+            stride = tile_size - overlap
+            positions = [
+                (y, x)
+                for y in self.tile_positions(padded_h, tile_size, stride)
+                for x in self.tile_positions(padded_w, tile_size, stride)
+            ]
+            window = self.blend_window(tile_size, overlap)
+
+            # Only the two accumulators are full resolution; tiles are streamed per batch
+            prob_sum = np.zeros((padded_h, padded_w), dtype=np.float32)
+            weight_sum = np.zeros((padded_h, padded_w), dtype=np.float32)
+            for coords, batch in self.iter_tile_batches(padded, positions, tile_size, self.tile_batch_size):
+                predictions = self.segmentation_model.predict(batch, batch_size=len(batch), verbose=0)
+                predictions = predictions.reshape(len(batch), tile_size, tile_size)
+                for (y, x), prob in zip(coords, predictions):
+                    prob_sum[y:y + tile_size, x:x + tile_size] += prob * window
+                    weight_sum[y:y + tile_size, x:x + tile_size] += window
+
+            del padded
+            # Divide in place and mask the decoded image in place; neither is needed afterwards
+            prob_map = np.divide(prob_sum[:height, :width], weight_sum[:height, :width],
+                                 out=prob_sum[:height, :width])
+            del weight_sum
+            mask = np.multiply(prob_map > 0.5, 255, dtype=np.uint8)
+            del prob_map, prob_sum
+            image[mask == 0] = 255
+            return Image.fromarray(mask), Image.fromarray(image)
+        except Exception as e:
+            print(f"Error in tiled segmentation: {e}")
+            return None, None
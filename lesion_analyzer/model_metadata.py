@@ -0,0 +1,131 @@
+"""Read input/output shapes from a .keras archive without building the model"""
+import zipfile
+import json
+import os
+
+METADATA_SUFFIX = '.meta.json'
+
+
+def _dtype_name(dtype):
+    # Keras 3 serialises dtype policies as {'class_name': 'DTypePolicy', 'config': {'name': ...}}
+    if isinstance(dtype, dict):
+        return dtype.get('config', {}).get('name')
+    return dtype
+
+
+def _layer_shape(layer):
+    config = layer.get('config', {})
+    shape = config.get('batch_shape') or config.get('batch_input_shape')
+    return list(shape) if shape else None
+
+
+def _count_layers(model_config):
+    """Layers in the model, including those of nested sub-models"""
+    total = 0
+    for layer in model_config.get('config', {}).get('layers', []):
+        total += 1
+        if 'layers' in layer.get('config', {}):
+            total += _count_layers(layer)
+    return total
+
+
+def _output_shape(layer):
+    """Best-effort output shape; spatial dimensions are unknown without building the graph"""
+    config = layer.get('config', {})
+    if 'units' in config:
+        return [None, config['units']]
+    if 'filters' in config:
+        return [None, None, None, config['filters']]
+    return None
+
+
+def _layer_refs(refs):
+    """Layer names from input_layers/output_layers, which Keras 3 flattens for single tensors"""
+    if not refs:
+        return []
+    if isinstance(refs, dict):
+        refs = list(refs.values())
+    if isinstance(refs[0], str):
+        return [refs[0]]
+    return [ref[0] for ref in refs if ref]
+
+
+def parse_model_config(config):
+    model_config = config.get('config', {})
+    layers = model_config.get('layers', [])
+    layers_by_name = {layer.get('config', {}).get('name', layer.get('name')): layer for layer in layers}
+    for layer in layers:
+        if 'name' in layer:
+            layers_by_name.setdefault(layer['name'], layer)
+
+    input_layers = [layers_by_name.get(name) for name in _layer_refs(model_config.get('input_layers'))]
+    input_layers = [layer for layer in input_layers if layer is not None]
+    if not input_layers:
+        # Sequential models: an InputLayer, or a first layer carrying batch_input_shape
+        input_layers = [layer for layer in layers if layer.get('class_name') == 'InputLayer'][:1]
+        if not input_layers and layers and _layer_shape(layers[0]):
+            input_layers = layers[:1]
+
+    output_layers = [layers_by_name.get(name) for name in _layer_refs(model_config.get('output_layers'))]
+    output_layers = [layer for layer in output_layers if layer is not None]
+    if not output_layers and layers:
+        output_layers = layers[-1:]
+
+    return {
+        'name': model_config.get('name'),
+        'class_name': config.get('class_name'),
+        'input_shapes': [_layer_shape(layer) for layer in input_layers],
+        'output_shapes': [_output_shape(layer) for layer in output_layers],
+        'output_activations': [layer.get('config', {}).get('activation') for layer in output_layers],
+        'dtype': _dtype_name(input_layers[0].get('config', {}).get('dtype')) if input_layers else None,
+        'layer_count': _count_layers(config),
+    }
+
+
+def read_model_metadata(model_path, use_cache=True):
+    """Metadata for a .keras model, cached in a sidecar file next to it.
+
+    The sidecar is reused while the model file's size and modification time
+    are unchanged, so repeated startups never reopen the archive.
+    """
+    stat = os.stat(model_path)
+    cache_path = model_path + METADATA_SUFFIX
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as cache_file:
+                cached = json.load(cache_file)
+            if cached.get('source_size') == stat.st_size and cached.get('source_mtime') == stat.st_mtime:
+                return cached['metadata']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    with zipfile.ZipFile(model_path) as archive:
+        config = json.loads(archive.read('config.json').decode('utf-8'))
+        keras_version = None
+        if 'metadata.json' in archive.namelist():
+            keras_version = json.loads(archive.read('metadata.json').decode('utf-8')).get('keras_version')
+
+    metadata = parse_model_config(config)
+    metadata['keras_version'] = keras_version
+
+    if use_cache:
+        try:
+            with open(cache_path, 'w') as cache_file:
+                json.dump({
+                    'source_size': stat.st_size,
+                    'source_mtime': stat.st_mtime,
+                    'metadata': metadata,
+                }, cache_file, indent=2)
+        except OSError as e:
+            print(f"Could not write model metadata cache {cache_path}: {e}")
+    return metadata
+
+
+def input_size(metadata):
+    """(height, width) of the first input, or None if the model does not fix it"""
+    if not metadata['input_shapes'] or not metadata['input_shapes'][0]:
+        return None
+    shape = metadata['input_shapes'][0]
+    if len(shape) != 4 or shape[1] is None or shape[2] is None:
+        return None
+    return shape[1], shape[2]
@@ -23,6 +23,28 @@ class LesionAnalysis(models.Model):
     predicted_class = models.CharField(max_length=4, choices=LESION_CLASSES, blank=True)
     confidence_score = models.FloatField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    # Morphometrics computed from the segmentation mask
+    lesion_area = models.FloatField(blank=True, null=True)
+    lesion_perimeter = models.FloatField(blank=True, null=True)
+    asymmetry_score = models.FloatField(blank=True, null=True)
+    border_irregularity = models.FloatField(blank=True, null=True)
+    color_variance = models.FloatField(blank=True, null=True)
+    diameter_px = models.FloatField(blank=True, null=True)
+    # Grid the features were measured on, e.g. '256x256'; blank for rows measured before normalisation
+    feature_resolution = models.CharField(max_length=16, blank=True)
+
+    # Image quality metrics measured before inference
+    quality_sharpness = models.FloatField(blank=True, null=True)
+    quality_brightness = models.FloatField(blank=True, null=True)
+    quality_clipped_fraction = models.FloatField(blank=True, null=True)
+    quality_skin_coverage = models.FloatField(blank=True, null=True)
+    quality_issues = models.CharField(max_length=255, blank=True)
+
+    # Grad-CAM heatmap (grayscale PNG at feature-map resolution) and inference timings
+    explanation_heatmap = models.BinaryField(blank=True, null=True)
+    classification_ms = models.FloatField(blank=True, null=True)
+    explanation_ms = models.FloatField(blank=True, null=True)
     
     class Meta:
         ordering = ['-created_at']
@@ -30,17 +52,17 @@ class LesionAnalysis(models.Model):
     def __str__(self):
         return f'Analysis {self.id} - {self.get_predicted_class_display()}'
     
+    def file_paths(self):
+        """Paths of the upload, mask and segmented region stored for this analysis"""
+        return [
+            field.path for field in (self.image, self.segmentation_mask, self.segmented_region)
+            if field
+        ]
+
     def delete(self, *args, **kwargs):
         """Override delete method to remove files from disk"""
         # Store file paths before deleting the model instance
-        files_to_delete = []
-        
-        if self.image:
-            files_to_delete.append(self.image.path)
-        if self.segmentation_mask:
-            files_to_delete.append(self.segmentation_mask.path)
-        if self.segmented_region:
-            files_to_delete.append(self.segmented_region.path)
+        files_to_delete = self.file_paths()
         
         # Delete the model instance first
         super().delete(*args, **kwargs)
@@ -0,0 +1,85 @@
+import numpy as np
+import cv2
+
+FEATURE_FIELDS = [
+    'lesion_area', 'lesion_perimeter', 'asymmetry_score',
+    'border_irregularity', 'color_variance', 'diameter_px', 'feature_resolution',
+]
+
+
+def resolution_label(shape):
+    return f'{shape[1]}x{shape[0]}'
+
+
+def empty_features(shape):
+    features = {field: None for field in FEATURE_FIELDS}
+    features['lesion_area'] = 0.0
+    features['feature_resolution'] = resolution_label(shape)
+    return features
+
+
+def principal_axis_alignment(binary, moments):
+    """Rotate the mask so its major axis is horizontal and its centroid is centred"""
+    height, width = binary.shape
+    cx = moments['m10'] / moments['m00']
+    cy = moments['m01'] / moments['m00']
+    angle = 0.5 * np.degrees(np.arctan2(2 * moments['mu11'], moments['mu20'] - moments['mu02']))
+    size = int(np.ceil(np.hypot(height, width)))
+    matrix = cv2.getRotationMatrix2D((cx, cy), angle, 1.0)
+    matrix[0, 2] += size / 2 - cx
+    matrix[1, 2] += size / 2 - cy
+    return cv2.warpAffine(binary, matrix, (size, size), flags=cv2.INTER_NEAREST)
+
+
+def compute_lesion_features(mask, image=None, reference_size=None):
+    """Compute ABCD-style morphometrics from a binary mask and optional RGB image.
+
+    With reference_size (height, width) the mask is first resampled to that grid,
+    so pixel measurements from full-resolution and resized masks are comparable.
+    """
+    mask = np.asarray(mask)
+    if mask.ndim == 3:
+        mask = mask[:, :, 0]
+    if reference_size is not None and mask.shape != tuple(reference_size):
+        mask = cv2.resize(mask.astype(np.uint8), (reference_size[1], reference_size[0]),
+                          interpolation=cv2.INTER_AREA)
+    binary = (mask > 127).astype(np.uint8)
+
+    moments = cv2.moments(binary, binaryImage=True)
+    area = moments['m00']
+    if area == 0:
+        return empty_features(binary.shape)
+
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    perimeter = sum(cv2.arcLength(contour, True) for contour in contours)
+
+    # Largest distance between convex hull points (maximum Feret diameter)
+    hull = cv2.convexHull(np.vstack(contours)).reshape(-1, 2).astype(np.float32)
+    diffs = hull[:, None, :] - hull[None, :, :]
+    diameter = float(np.sqrt((diffs ** 2).sum(axis=-1)).max())
+
+    # Asymmetry: fraction of the lesion not overlapping its mirror image about each principal axis
+    aligned = principal_axis_alignment(binary, moments).astype(bool)
+    aligned_area = max(aligned.sum(), 1)
+    major = np.logical_xor(aligned, aligned[::-1, :]).sum() / (2 * aligned_area)
+    minor = np.logical_xor(aligned, aligned[:, ::-1]).sum() / (2 * aligned_area)
+
+    # Compactness index: 1.0 for a perfect circle, grows with ragged borders
+    border_irregularity = perimeter ** 2 / (4 * np.pi * area)
+
+    color_variance = None
+    if image is not None:
+        image = np.asarray(image)
+        if image.shape[:2] == binary.shape:
+            pixels = image[binary.astype(bool)].reshape(-1, image.shape[-1] if image.ndim == 3 else 1)
+            color_variance = float(pixels.astype(np.float32).var(axis=0).mean())
+
+    return {
+        'lesion_area': float(area),
+        'lesion_perimeter': float(perimeter),
+        'asymmetry_score': float((major + minor) / 2),
+        'border_irregularity': float(border_irregularity),
+        'color_variance': color_variance,
+        'diameter_px': diameter,
+        'feature_resolution': resolution_label(binary.shape),
+    }
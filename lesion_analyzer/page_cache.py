@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.template.loader import get_template
+from django.template.loader_tags import ExtendsNode
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+import threading
+import hashlib
+import json
+import uuid
+
+DASHBOARD_FRAGMENT = 'home_dashboard'
+DASHBOARD_VERSION_KEY = 'lesion_analyzer:dashboard_version'
+DASHBOARD_TEMPLATE = 'lesion_analyzer/home.html'
+
+_deferral = threading.local()
+
+
+def page_cache_timeout():
+    return getattr(settings, 'LESION_PAGE_CACHE_TIMEOUT', 60 * 60)
+
+
+def template_sources(template_name):
+    """Source of a template followed by those of the templates it extends"""
+    template = get_template(template_name).template
+    sources = [template.source]
+    for node in template.nodelist:
+        if isinstance(node, ExtendsNode) and isinstance(node.parent_name.var, str):
+            sources += template_sources(node.parent_name.var)
+    return sources
+
+
+def data_version(data):
+    """Digest of page data defined in code, such as LESION_DATA"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+@lru_cache(maxsize=None)
+def template_etag(template_name, data_token=''):
+    """ETag for a page that only changes when its templates (base.html included) or data do"""
+    digest = hashlib.sha256(data_token.encode('utf-8'))
+    for source in template_sources(template_name):
+        digest.update(source.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def unless_messages_pending(etag_func):
+    """No ETag, and so no 304, while flash messages wait to be rendered by base.html"""
+    @wraps(etag_func)
+    def wrapper(request, *args, **kwargs):
+        if get_messages(request):
+            return None
+        return etag_func(request, *args, **kwargs)
+    return wrapper
+
+
+def dashboard_version():
+    """Token that changes whenever an analysis is saved or deleted"""
+    version = cache.get(DASHBOARD_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(DASHBOARD_VERSION_KEY, version, None)
+        version = cache.get(DASHBOARD_VERSION_KEY, version)
+    return version
+
+
+def invalidate_dashboard():
+    if getattr(_deferral, 'active', False):
+        _deferral.pending = True
+        return
+    cache.delete(make_template_fragment_key(DASHBOARD_FRAGMENT, [template_etag(DASHBOARD_TEMPLATE)]))
+    cache.set(DASHBOARD_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+@contextmanager
+def deferred_dashboard_invalidation():
+    """Invalidate the dashboard once after a bulk save or delete instead of once per row"""
+    if getattr(_deferral, 'active', False):
+        yield
+        return
+    _deferral.active = True
+    _deferral.pending = False
+    try:
+        yield
+    finally:
+        _deferral.active = False
+        if _deferral.pending:
+            invalidate_dashboard()
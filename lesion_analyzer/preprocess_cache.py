@@ -0,0 +1,214 @@
+"""Packed on-disk cache of preprocessed image arrays read through a memory map"""
+import numpy as np
+import threading
+import hashlib
+import sqlite3
+import time
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+INDEX_FILENAME = 'index.sqlite3'
+DATA_FILENAME = 'tensors.bin'
+LOCK_FILENAME = 'cache.lock'
+KEY_BYTES = 32
+# Hits are buffered and written to the shared LRU index every TOUCH_INTERVAL
+# seconds or TOUCH_BATCH distinct keys, whichever comes first
+TOUCH_INTERVAL = 5.0
+TOUCH_BATCH = 1024
+
+
+def content_hash(image_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as image_file:
+        for block in iter(lambda: image_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PreprocessCache:
+    """Fixed-size slots of shape (H, W, 3) uint8 in one file, with an LRU slot index.
+
+    Each slot starts with a digest of the preprocessing fingerprint and the
+    image content hash, so a reader that races an eviction, or a process
+    running different preprocessing, sees a mismatch and treats it as a miss
+    rather than returning another image's tensor. The index lives in SQLite,
+    so an insert updates one row instead of rewriting the whole index.
+
+    Reads copy straight out of the memory map. They do not return a zero-copy
+    view, because once the shared lock is released another process may evict
+    the slot and overwrite it in place.
+    """
+
+    def __init__(self, cache_dir, fingerprint, shape=(256, 256, 3), max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.fingerprint = fingerprint
+        self.shape = tuple(shape)
+        self.record_bytes = int(np.prod(self.shape))
+        self.slot_bytes = KEY_BYTES + self.record_bytes
+        self.capacity = max(int(max_bytes // self.slot_bytes), 1)
+        self.layout = f'{self.shape}:{self.capacity}'
+
+        self.index_path = os.path.join(cache_dir, INDEX_FILENAME)
+        self.data_path = os.path.join(cache_dir, DATA_FILENAME)
+        self.lock_path = os.path.join(cache_dir, LOCK_FILENAME)
+        self.thread_lock = threading.RLock()
+        self.local = threading.local()
+        self.touched = {}
+        self.touched_at = time.monotonic()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.data_fd = os.open(self.data_path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        with self.locked():
+            db = self.db()
+            db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            db.execute('CREATE TABLE IF NOT EXISTS entries '
+                       '(key TEXT PRIMARY KEY, slot INTEGER UNIQUE NOT NULL, used REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+            meta = dict(db.execute('SELECT name, value FROM meta'))
+            if meta.get('layout') != self.layout or meta.get('fingerprint') != self.fingerprint:
+                self.reset(db)
+        self.data = np.memmap(self.data_path, dtype=np.uint8, mode='r+',
+                              shape=(self.capacity, self.slot_bytes))
+
+    def db(self):
+        """SQLite connection for the calling thread, never reused across a fork"""
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    def locked(self, shared=False):
+        return _CacheLock(self, shared)
+
+    def reset(self, db):
+        """Drop every entry and reallocate the data file; call with the exclusive lock held"""
+        db.execute('BEGIN IMMEDIATE')
+        db.execute('DELETE FROM entries')
+        db.execute('DELETE FROM meta')
+        db.executemany('INSERT INTO meta (name, value) VALUES (?, ?)', [
+            ('layout', self.layout), ('fingerprint', self.fingerprint), ('next_slot', '0'),
+        ])
+        # Truncating frees the old tensors; the file never shrinks below its old
+        # size, so a process still mapping an older, larger layout cannot fault
+        size = max(os.fstat(self.data_fd).st_size, self.capacity * self.slot_bytes)
+        os.ftruncate(self.data_fd, 0)
+        os.ftruncate(self.data_fd, size)
+        db.execute('COMMIT')
+
+    def slot_key(self, key):
+        return hashlib.sha256(f'{self.fingerprint}:{key}'.encode('utf-8')).digest()
+
+    def get(self, key):
+        """Return the cached array, or None on a miss"""
+        digest = self.slot_key(key)
+        with self.locked(shared=True):
+            row = self.db().execute('SELECT slot FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            record = self.data[row[0]]
+            array = record[KEY_BYTES:].reshape(self.shape).copy()
+            if record[:KEY_BYTES].tobytes() != digest:
+                return None
+        self.touch(key)
+        return array
+
+    def touch(self, key):
+        """Buffer an LRU hit, so reads do not each take the index write lock"""
+        with self.thread_lock:
+            self.touched[key] = time.time()
+            due = (len(self.touched) >= TOUCH_BATCH
+                   or time.monotonic() - self.touched_at >= TOUCH_INTERVAL)
+        if due:
+            db = self.db()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                self.flush_touches(db)
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def flush_touches(self, db):
+        """Write buffered hits inside the caller's transaction"""
+        with self.thread_lock:
+            touched, self.touched = self.touched, {}
+            self.touched_at = time.monotonic()
+        db.executemany('UPDATE entries SET used = MAX(used, ?) WHERE key = ?',
+                       [(used, key) for key, used in touched.items()])
+
+    def put(self, key, array):
+        array = np.ascontiguousarray(array, dtype=np.uint8)
+        if array.shape != self.shape:
+            raise ValueError(f'Expected array of shape {self.shape}, got {array.shape}')
+
+        db = self.db()
+        with self.locked():
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                # Pending hits go in first so the eviction below sees them
+                self.flush_touches(db)
+                if db.execute('SELECT 1 FROM entries WHERE key = ?', (key,)).fetchone():
+                    db.execute('UPDATE entries SET used = ? WHERE key = ?', (time.time(), key))
+                    db.execute('COMMIT')
+                    return
+                next_slot = int(db.execute("SELECT value FROM meta WHERE name = 'next_slot'").fetchone()[0])
+                if next_slot < self.capacity:
+                    slot = next_slot
+                    db.execute("UPDATE meta SET value = ? WHERE name = 'next_slot'", (str(next_slot + 1),))
+                else:
+                    lru_key, slot = db.execute('SELECT key, slot FROM entries ORDER BY used LIMIT 1').fetchone()
+                    db.execute('DELETE FROM entries WHERE key = ?', (lru_key,))
+                self.write_slot(slot, self.slot_key(key) + array.tobytes())
+                db.execute('INSERT INTO entries (key, slot, used) VALUES (?, ?, ?)', (key, slot, time.time()))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def write_slot(self, slot, record):
+        offset = slot * self.slot_bytes
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.data_fd, record, offset)
+            return
+        with self.thread_lock:
+            os.lseek(self.data_fd, offset, os.SEEK_SET)
+            os.write(self.data_fd, record)
+
+    def __len__(self):
+        return self.db().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+
+class _CacheLock:
+    """Advisory file lock shared by every process using the cache.
+
+    Readers take it shared and writers exclusive, so a slot is never read
+    while it is being overwritten. Without fcntl only threads are serialised.
+    """
+
+    def __init__(self, cache, shared=False):
+        self.cache = cache
+        self.shared = shared
+        self.lock_file = None
+
+    def __enter__(self):
+        if fcntl is None:
+            self.cache.thread_lock.acquire()
+            return self
+        self.lock_file = open(self.cache.lock_path, 'a')
+        fcntl.flock(self.lock_file, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.lock_file is None:
+            self.cache.thread_lock.release()
+            return
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import LesionAnalysis
+from .page_cache import invalidate_dashboard
+
+
+@receiver(post_save, sender=LesionAnalysis)
+@receiver(post_delete, sender=LesionAnalysis)
+def invalidate_home_dashboard(sender, **kwargs):
+    invalidate_dashboard()
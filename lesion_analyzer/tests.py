@@ -1,3 +1,49 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
+import numpy as np
+import tempfile
+import shutil
+import cv2
+import os
 
-# Create your tests here.
+from .ml_utils import LesionClassifier
+
+
+def dermoscopy_image(width=800, height=600, seed=0):
+    """Skin-toned image with a textured lesion; black scope corners cover most of the frame"""
+    rng = np.random.default_rng(seed)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = (120, 150, 200)  # BGR skin tone
+    noise = rng.integers(-12, 13, (height, width, 1))
+    image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    cv2.ellipse(image, (width // 2, height // 2), (90, 70), 20, 0, 360, (40, 50, 90), -1)
+    vignette = np.zeros((height, width), dtype=np.uint8)
+    cv2.circle(vignette, (width // 2, height // 2), int(min(width, height) * 0.4), 255, -1)
+    image[vignette == 0] = 0
+    return image
+
+
+class ImageQualityTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.classifier = LesionClassifier(load_models=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assess(self, image):
+        path = os.path.join(self.directory, 'image.png')
+        cv2.imwrite(path, image)
+        return self.classifier.assess_image_quality(path)
+
+    def test_vignetted_image_passes(self):
+        self.assertEqual(self.assess(dermoscopy_image())['issues'], [])
+
+    def test_small_highlight_on_vignetted_image_passes(self):
+        image = dermoscopy_image()
+        image[300:306, 400:406] = 255
+        self.assertEqual(self.assess(image)['issues'], [])
+
+    def test_blown_out_image_is_flagged(self):
+        image = dermoscopy_image()
+        image[:, :600] = 255
+        self.assertIn('Too much of the image is blown out', self.assess(image)['issues'])
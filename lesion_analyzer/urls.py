@@ -9,8 +9,13 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('lesion-types/', views.lesion_types, name='lesion_types'),
     path('how-it-works/', views.how_it_works, name='how_it_works'),
-    path('upload/', views.upload_image, name='upload'),
+    # The async view keeps inference off Django's thread-sensitive executor under ASGI
+    path('upload/', views.upload_image_async, name='upload'),
+    path('upload/sync/', views.upload_image, name='upload_sync'),
+    path('api/analyze/', views.api_analyze, name='api_analyze'),
+    path('metrics/admission/', views.admission_metrics, name='admission_metrics'),
     path('results/<int:analysis_id>/', views.view_results, name='results'),
+    path('results/<int:analysis_id>/explanation.png', views.explanation_heatmap, name='explanation'),
     path('history/', views.analysis_history, name='history'),
     
     # Add this new URL pattern for delete functionality
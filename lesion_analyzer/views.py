@@ -1,176 +1,198 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.core.files.base import ContentFile
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import condition, require_POST
+from asgiref.sync import sync_to_async
 from .models import LesionAnalysis
 from .forms import ImageUploadForm
-from .ml_utils import LesionClassifier
-import io
-import os
+from .explain import render_heatmap
+from .ml_utils import ImageQualityError
+from .inference import analyze_image, check_upload_quality, get_inference_executor, save_analysis_result
+from .admission import AdmissionRejected, client_key, get_admission_controller
+from .page_cache import (
+    DASHBOARD_TEMPLATE, dashboard_version, data_version, page_cache_timeout, template_etag, unless_messages_pending,
+)
+from functools import partial
+import asyncio
 from django.conf import settings
 
 
+LESION_DATA = [
+    {
+        'code': 'MEL',
+        'name': 'Melanoma',
+        'description': 'A serious form of skin cancer that develops in melanocytes, the cells that produce pigment.',
+        'image_filename': 'melanoma_example.jpg',
+        'characteristics': [
+            'Asymmetrical shape',
+            'Irregular borders', 
+            'Multiple colors or color changes',
+            'Diameter larger than 6mm',
+            'Evolving size, shape, or color'
+        ],
+        'risk_factors': ['UV exposure', 'Fair skin', 'Family history', 'Many moles']
+    },
+    {
+        'code': 'NV',
+        'name': 'Melanocytic Nevus',
+        'description': 'Common benign skin lesions, also known as moles, formed by clusters of melanocytes.',
+        'image_filename': 'nevus_example.jpg',
+        'characteristics': [
+            'Usually symmetrical',
+            'Smooth, regular borders',
+            'Uniform color (brown, black, or flesh-colored)',
+            'Stable size and appearance',
+            'Can be flat or raised'
+        ],
+        'risk_factors': ['Genetics', 'Sun exposure', 'Hormonal changes']
+    },
+    {
+        'code': 'BCC',
+        'name': 'Basal Cell Carcinoma',
+        'description': 'The most common type of skin cancer, arising from basal cells in the lower part of the epidermis.',
+        'image_filename': 'bcc_example.jpg',
+        'characteristics': [
+            'Pearl-like or waxy appearance',
+            'Raised edges with central depression',
+            'May bleed easily',
+            'Slow-growing',
+            'Often on sun-exposed areas'
+        ],
+        'risk_factors': ['Chronic sun exposure', 'Fair skin', 'Age', 'Male gender']
+    },
+    {
+        'code': 'AKIEC',
+        'name': 'Actinic Keratosis',
+        'description': 'Precancerous lesions caused by sun damage that may develop into squamous cell carcinoma.',
+        'image_filename': 'ak_example.jpg',
+        'characteristics': [
+            'Rough, scaly texture',
+            'Red, brown, or skin-colored',
+            'Flat or slightly raised',
+            'May be tender or itchy',
+            'On sun-exposed areas'
+        ],
+        'risk_factors': ['Chronic sun exposure', 'Fair skin', 'Age over 40', 'Immunosuppression']
+    },
+    {
+        'code': 'BKL',
+        'name': 'Benign Keratosis',
+        'description': 'Non-cancerous skin growths including seborrheic keratoses that appear with aging.',
+        'image_filename': 'bkl_example.jpg',
+        'characteristics': [
+            'Waxy, "stuck-on" appearance',
+            'Brown, black, or tan color',
+            'Well-defined borders',
+            'Rough or smooth surface',
+            'Various sizes'
+        ],
+        'risk_factors': ['Aging', 'Genetics', 'Sun exposure history']
+    },
+    {
+        'code': 'DF',
+        'name': 'Dermatofibroma',
+        'description': 'Benign skin nodules composed of fibrous tissue, often appearing after minor skin trauma.',
+        'image_filename': 'df_example.jpg',
+        'characteristics': [
+            'Firm, small nodules',
+            'Brown, red, or pink color',
+            'Dimples when pinched',
+            'Usually on legs or arms',
+            'Slow-growing'
+        ],
+        'risk_factors': ['Minor skin trauma', 'Insect bites', 'More common in women']
+    },
+    {
+        'code': 'VASC',
+        'name': 'Vascular Lesions',
+        'description': 'Lesions involving blood vessels, including hemangiomas, cherry angiomas, and other vascular malformations.',
+        'image_filename': 'vasc_example.jpg',
+        'characteristics': [
+            'Red, purple, or blue color',
+            'May blanch with pressure',
+            'Smooth or raised surface',
+            'Various sizes',
+            'Well-defined borders'
+        ],
+        'risk_factors': ['Age', 'Genetics', 'Hormonal changes', 'Sun exposure']
+    },
+    {
+        'code': 'SCC',
+        'name': 'Squamous Cell Carcinoma',
+        'description': 'Second most common skin cancer, arising from squamous cells in the upper layers of skin.',
+        'image_filename': 'scc_example.jpg',
+        'characteristics': [
+            'Scaly, rough surface',
+            'Red, inflamed appearance',
+            'May ulcerate or crust',
+            'Rapid growth',
+            'On sun-exposed areas'
+        ],
+        'risk_factors': ['Chronic sun exposure', 'Fair skin', 'Immunosuppression', 'HPV infection']
+    }
+]
+LESION_DATA_VERSION = data_version(LESION_DATA)
+
+
+def home_etag(request):
+    return f"{template_etag(DASHBOARD_TEMPLATE)}-{dashboard_version()}"
+
+def lesion_types_etag(request):
+    return template_etag('lesion_analyzer/lesion_types.html', LESION_DATA_VERSION)
+
+def how_it_works_etag(request):
+    return template_etag('lesion_analyzer/how_it_works.html')
+
+
+@condition(etag_func=unless_messages_pending(home_etag))
 def home(request):
     """Home page with introduction"""
+    # Both are evaluated lazily inside the cached dashboard fragment, so a cache hit runs no queries
     recent_analyses = LesionAnalysis.objects.all()[:6]  # Show 6 recent analyses
     context = {
         'recent_analyses': recent_analyses,
-        'total_analyses': LesionAnalysis.objects.count()
+        'total_analyses': LesionAnalysis.objects.count,
+        'cache_timeout': page_cache_timeout(),
+        'page_version': template_etag(DASHBOARD_TEMPLATE),
     }
     return render(request, 'lesion_analyzer/home.html', context)
 
+@condition(etag_func=unless_messages_pending(lesion_types_etag))
 def lesion_types(request):
-    lesion_data = [
-        {
-            'code': 'MEL',
-            'name': 'Melanoma',
-            'description': 'A serious form of skin cancer that develops in melanocytes, the cells that produce pigment.',
-            'image_filename': 'melanoma_example.jpg',
-            'characteristics': [
-                'Asymmetrical shape',
-                'Irregular borders', 
-                'Multiple colors or color changes',
-                'Diameter larger than 6mm',
-                'Evolving size, shape, or color'
-            ],
-            'risk_factors': ['UV exposure', 'Fair skin', 'Family history', 'Many moles']
-        },
-        {
-            'code': 'NV',
-            'name': 'Melanocytic Nevus',
-            'description': 'Common benign skin lesions, also known as moles, formed by clusters of melanocytes.',
-            'image_filename': 'nevus_example.jpg',
-            'characteristics': [
-                'Usually symmetrical',
-                'Smooth, regular borders',
-                'Uniform color (brown, black, or flesh-colored)',
-                'Stable size and appearance',
-                'Can be flat or raised'
-            ],
-            'risk_factors': ['Genetics', 'Sun exposure', 'Hormonal changes']
-        },
-        {
-            'code': 'BCC',
-            'name': 'Basal Cell Carcinoma',
-            'description': 'The most common type of skin cancer, arising from basal cells in the lower part of the epidermis.',
-            'image_filename': 'bcc_example.jpg',
-            'characteristics': [
-                'Pearl-like or waxy appearance',
-                'Raised edges with central depression',
-                'May bleed easily',
-                'Slow-growing',
-                'Often on sun-exposed areas'
-            ],
-            'risk_factors': ['Chronic sun exposure', 'Fair skin', 'Age', 'Male gender']
-        },
-        {
-            'code': 'AKIEC',
-            'name': 'Actinic Keratosis',
-            'description': 'Precancerous lesions caused by sun damage that may develop into squamous cell carcinoma.',
-            'image_filename': 'ak_example.jpg',
-            'characteristics': [
-                'Rough, scaly texture',
-                'Red, brown, or skin-colored',
-                'Flat or slightly raised',
-                'May be tender or itchy',
-                'On sun-exposed areas'
-            ],
-            'risk_factors': ['Chronic sun exposure', 'Fair skin', 'Age over 40', 'Immunosuppression']
-        },
-        {
-            'code': 'BKL',
-            'name': 'Benign Keratosis',
-            'description': 'Non-cancerous skin growths including seborrheic keratoses that appear with aging.',
-            'image_filename': 'bkl_example.jpg',
-            'characteristics': [
-                'Waxy, "stuck-on" appearance',
-                'Brown, black, or tan color',
-                'Well-defined borders',
-                'Rough or smooth surface',
-                'Various sizes'
-            ],
-            'risk_factors': ['Aging', 'Genetics', 'Sun exposure history']
-        },
-        {
-            'code': 'DF',
-            'name': 'Dermatofibroma',
-            'description': 'Benign skin nodules composed of fibrous tissue, often appearing after minor skin trauma.',
-            'image_filename': 'df_example.jpg',
-            'characteristics': [
-                'Firm, small nodules',
-                'Brown, red, or pink color',
-                'Dimples when pinched',
-                'Usually on legs or arms',
-                'Slow-growing'
-            ],
-            'risk_factors': ['Minor skin trauma', 'Insect bites', 'More common in women']
-        },
-        {
-            'code': 'VASC',
-            'name': 'Vascular Lesions',
-            'description': 'Lesions involving blood vessels, including hemangiomas, cherry angiomas, and other vascular malformations.',
-            'image_filename': 'vasc_example.jpg',
-            'characteristics': [
-                'Red, purple, or blue color',
-                'May blanch with pressure',
-                'Smooth or raised surface',
-                'Various sizes',
-                'Well-defined borders'
-            ],
-            'risk_factors': ['Age', 'Genetics', 'Hormonal changes', 'Sun exposure']
-        },
-        {
-            'code': 'SCC',
-            'name': 'Squamous Cell Carcinoma',
-            'description': 'Second most common skin cancer, arising from squamous cells in the upper layers of skin.',
-            'image_filename': 'scc_example.jpg',
-            'characteristics': [
-                'Scaly, rough surface',
-                'Red, inflamed appearance',
-                'May ulcerate or crust',
-                'Rapid growth',
-                'On sun-exposed areas'
-            ],
-            'risk_factors': ['Chronic sun exposure', 'Fair skin', 'Immunosuppression', 'HPV infection']
-        }
-    ]
-    
     context = {
-        'lesion_data': lesion_data
+        'lesion_data': LESION_DATA,
+        'cache_timeout': page_cache_timeout(),
+        'page_version': lesion_types_etag(request),
     }
     return render(request, 'lesion_analyzer/lesion_types.html', context)
 
+@condition(etag_func=unless_messages_pending(how_it_works_etag))
 def how_it_works(request):
     """Page explaining the AI analysis procedure"""
-    return render(request, 'lesion_analyzer/how_it_works.html')
+    context = {
+        'cache_timeout': page_cache_timeout(),
+        'page_version': how_it_works_etag(request),
+    }
+    return render(request, 'lesion_analyzer/how_it_works.html', context)
 
 def upload_image(request):
     if request.method == 'POST':
         form = ImageUploadForm(request.POST, request.FILES)
         if form.is_valid():
             try:
-                analysis = form.save()
-                classifier = LesionClassifier()
-                predicted_class, confidence = classifier.classify_lesion(analysis.image.path)
-                analysis.predicted_class = predicted_class
-                analysis.confidence_score = confidence
-                mask_image, segmented_image = classifier.generate_segmentation_mask(analysis.image.path)
-
-                if mask_image and segmented_image:
-                    mask_io = io.BytesIO()
-                    mask_image.save(mask_io, format='PNG')
-                    mask_content = ContentFile(mask_io.getvalue())
-                    analysis.segmentation_mask.save(f'mask_{analysis.id}.png', mask_content, save=False)
-
-                    segmented_io = io.BytesIO()
-                    segmented_image.save(segmented_io, format='PNG')
-                    segmented_content = ContentFile(segmented_io.getvalue())
-                    analysis.segmented_region.save(f'segmented_{analysis.id}.png', segmented_content, save=False)
-
-                analysis.save()
+                with get_admission_controller().slot(client_key(request)):
+                    # Gate on the uploaded bytes so a rejected image is never saved
+                    quality = check_upload_quality(form.cleaned_data['image'])
+                    analysis = form.save()
+                    result = analyze_image(analysis.image.path, quality=quality)
+                    save_analysis_result(analysis, result)
                 messages.success(request, 'Image analyzed successfully!')
                 return redirect('lesion_analyzer:results', analysis_id=analysis.id)
+            except AdmissionRejected as rejection:
+                return rejected_upload_response(request, form, rejection)
+            except ImageQualityError as e:
+                messages.error(request, quality_rejection_message(e))
             except Exception as e:
                 messages.error(request, f'Error analyzing image: {str(e)}')
         else:
@@ -179,10 +201,110 @@ def upload_image(request):
         form = ImageUploadForm()
     return render(request, 'lesion_analyzer/upload.html', {'form': form})
 
+def quality_rejection_message(error):
+    return f'Image rejected: {error}. Please upload a sharp, well-lit close-up of the lesion.'
+
+def rejected_upload_response(request, form, rejection):
+    """Render the upload page with the shed status code and Retry-After"""
+    if rejection.status == 429:
+        messages.error(request, f'Too many uploads. Please try again in {rejection.retry_after} seconds.')
+    else:
+        messages.error(request, f'The analyzer is busy. Please try again in {rejection.retry_after} seconds.')
+    response = render(request, 'lesion_analyzer/upload.html', {'form': form}, status=rejection.status)
+    response['Retry-After'] = str(rejection.retry_after)
+    return response
+
+async def run_analysis_async(form, client):
+    """Save the upload, run inference on the bounded executor and persist the result.
+
+    Database and storage writes go through sync_to_async and inference through
+    the inference executor, so the event loop only ever awaits.
+    """
+    controller = get_admission_controller()
+    # Waiting for a slot blocks, so it happens on a worker thread rather than the loop
+    await sync_to_async(controller.acquire, thread_sensitive=False)(client)
+    try:
+        loop = asyncio.get_running_loop()
+        executor = get_inference_executor()
+        # Gate on the uploaded bytes so a rejected image is never saved
+        quality = await loop.run_in_executor(executor, check_upload_quality, form.cleaned_data['image'])
+        analysis = await sync_to_async(form.save)()
+        result = await loop.run_in_executor(executor, partial(analyze_image, analysis.image.path, quality=quality))
+        await sync_to_async(save_analysis_result)(analysis, result)
+    finally:
+        controller.release()
+    return analysis
+
+async def upload_image_async(request):
+    """Upload page; async so concurrent analyses do not queue behind one another under ASGI.
+
+    Rendering may touch the session and database, so it always goes through sync_to_async.
+    """
+    if request.method == 'POST':
+        form = ImageUploadForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                analysis = await run_analysis_async(form, client_key(request))
+                messages.success(request, 'Image analyzed successfully!')
+                return redirect('lesion_analyzer:results', analysis_id=analysis.id)
+            except AdmissionRejected as rejection:
+                return await sync_to_async(rejected_upload_response)(request, form, rejection)
+            except ImageQualityError as e:
+                messages.error(request, quality_rejection_message(e))
+            except Exception as e:
+                messages.error(request, f'Error analyzing image: {str(e)}')
+        else:
+            messages.error(request, 'Please upload a valid image file.')
+    else:
+        form = ImageUploadForm()
+    return await sync_to_async(render)(request, 'lesion_analyzer/upload.html', {'form': form})
+
+async def api_analyze(request):
+    """Analyze an uploaded image and return the result as JSON"""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    form = ImageUploadForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+    try:
+        analysis = await run_analysis_async(form, client_key(request))
+    except AdmissionRejected as rejection:
+        response = JsonResponse({'success': False, 'message': rejection.reason}, status=rejection.status)
+        response['Retry-After'] = str(rejection.retry_after)
+        return response
+    except ImageQualityError as e:
+        return JsonResponse({'success': False, 'message': str(e), 'quality': e.quality}, status=422)
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': f'Error analyzing image: {str(e)}'}, status=500)
+    return JsonResponse({
+        'success': True,
+        'analysis_id': analysis.id,
+        'predicted_class': analysis.predicted_class,
+        'confidence': analysis.confidence_score,
+        'quality_issues': analysis.quality_issues,
+        'classification_ms': analysis.classification_ms,
+        'explanation_ms': analysis.explanation_ms,
+        'results_url': reverse('lesion_analyzer:results', args=[analysis.id]),
+    })
+
+def admission_metrics(request):
+    """In-flight, queued and rejected analyses plus queue wait percentiles"""
+    return JsonResponse(get_admission_controller().metrics())
+
 def view_results(request, analysis_id):
     analysis = get_object_or_404(LesionAnalysis, id=analysis_id)
     return render(request, 'lesion_analyzer/results.html', {'analysis': analysis})
 
+@condition(etag_func=lambda request, analysis_id: f'explanation-{analysis_id}')
+def explanation_heatmap(request, analysis_id):
+    """Stored Grad-CAM heatmap, colourised; never recomputes the explanation"""
+    heatmap = LesionAnalysis.objects.filter(id=analysis_id).values_list('explanation_heatmap', flat=True).first()
+    if not heatmap:
+        raise Http404('No explanation stored for this analysis')
+    response = HttpResponse(render_heatmap(heatmap), content_type='image/png')
+    response['Cache-Control'] = f'max-age={page_cache_timeout()}'
+    return response
+
 def analysis_history(request):
     analyses = LesionAnalysis.objects.all()[:20]
     return render(request, 'lesion_analyzer/history.html', {'analyses': analyses})
@@ -193,25 +315,7 @@ def delete_analysis(request, analysis_id):
     try:
         analysis = get_object_or_404(LesionAnalysis, id=analysis_id)
         
-        # Delete the image files from disk
-        files_to_delete = []
-        
-        if analysis.image:
-            files_to_delete.append(analysis.image.path)
-        if analysis.segmentation_mask:
-            files_to_delete.append(analysis.segmentation_mask.path)
-        if analysis.segmented_region:
-            files_to_delete.append(analysis.segmented_region.path)
-        
-        # Delete files from filesystem
-        for file_path in files_to_delete:
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except OSError as e:
-                    print(f"Error deleting file {file_path}: {e}")
-        
-        # Delete the database entry
+        # Deletes the database entry and its files from disk
         analysis.delete()
         
         # Return JSON response for AJAX requests
@@ -85,9 +85,60 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# File-based so fragment invalidation on save/delete reaches every worker process
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'django',
+    }
+}
+LESION_PAGE_CACHE_TIMEOUT = 60 * 60  # seconds
+
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024   # 10MB
+LESION_MAX_IMAGE_PIXELS = 50_000_000  # checked from the image header before decoding
+# Decode large JPEGs at 1/2, 1/4 or 1/8 scale when that still covers the model input
+LESION_REDUCED_DECODE = True
+
+# Segmentation settings
+# 'resize' segments a 256x256 copy; 'tiled' segments overlapping 256x256 tiles
+# at native resolution and stitches a full-size mask
+LESION_SEGMENTATION_MODE = 'resize'
+LESION_SEGMENTATION_TILE_OVERLAP = 64
+LESION_SEGMENTATION_TILE_BATCH_SIZE = 8
+
+# Maximum number of analyses running preprocessing and inference at once
+LESION_INFERENCE_WORKERS = 2
+
+# Admission control: analyses beyond LESION_MAX_IN_FLIGHT wait in a queue of at
+# most LESION_MAX_QUEUED for LESION_QUEUE_TIMEOUT seconds, the rest get 503
+LESION_MAX_IN_FLIGHT = LESION_INFERENCE_WORKERS
+LESION_MAX_QUEUED = 8
+LESION_QUEUE_TIMEOUT = 10  # seconds
+LESION_RETRY_AFTER = 5  # seconds
+# Optional per-client limit in analyses per minute (None disables it), 429 when exceeded
+LESION_CLIENT_RATE_LIMIT = None
+LESION_CLIENT_BURST = 5
+
+# Image quality gate run before inference: 'reject' refuses unusable images,
+# 'flag' analyzes them but records the issues, 'off' skips the checks
+LESION_QUALITY_MODE = 'reject'
+LESION_QUALITY_MIN_SHARPNESS = 25.0  # variance of the Laplacian at 256px
+LESION_QUALITY_MIN_BRIGHTNESS = 40.0
+LESION_QUALITY_MAX_BRIGHTNESS = 220.0
+LESION_QUALITY_MAX_CLIPPED = 0.5  # fraction of pixels at either end of the histogram
+LESION_QUALITY_MIN_SKIN_COVERAGE = 0.5  # share of pixels not in clearly non-skin hues
+
+# Grad-CAM explanations computed alongside classification; concurrent requests
+# wait up to LESION_EXPLANATION_MAX_WAIT_MS to share a batch
+LESION_EXPLANATIONS = True
+LESION_EXPLANATION_BATCH_SIZE = 8
+LESION_EXPLANATION_MAX_WAIT_MS = 10
+
+# Preprocessed image cache (None disables it)
+LESION_PREPROCESS_CACHE_DIR = BASE_DIR / 'cache' / 'preprocessed'
+LESION_PREPROCESS_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2GB
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')